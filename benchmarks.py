@@ -0,0 +1,266 @@
+"""
+Benchmarks of the solver hot paths, for every size of cube
+
+usage:
+    python benchmarks.py [-s 2 3 ... 15] [-b BENCH ...] [--seed SEED] [--min-time SECONDS] [-o results.json]
+                         [--compare baseline.json] [--threshold 0.1]
+
+Every benchmark runs with fixed seeds, so two runs measure exactly the same work. For each benchmark and size it
+reports operations per second and the peak memory allocated by a single operation (tracemalloc). The results are
+written as JSON (with the commit they were taken on) so they can be compared against a previous run with --compare,
+that lists the ratio new/old of the ops/sec and exits with an error if something got slower than the threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from cubeBasics import Cube, Move, TAddress, Face, compileMove, compileMoves
+from util import Vars
+import methods as met
+
+
+def randomMoves(n, qty, rng):
+    """
+    :return: a list of qty random Move objects for a cube of size n
+    """
+    cube = Cube(n, compact=True, ids=False)
+    return [Move(cube, mov) for mov in cube.shuffle(qty, rng=rng).split()]
+
+
+def methodsWithConditions(metodos, n):
+    """
+    :return: the list of the methods with conditions that can run on a cube of size n
+    """
+    return [m for m in map(metodos.metodo, metodos.listaMetodos()) if m.listaCondiciones and m.minLado <= n]
+
+
+def benchOneMove(metodos, n, seed):
+    cube = Cube(n, compact=True, ids=False)
+    moves = randomMoves(n, 100, np.random.RandomState(seed))
+
+    def run():
+        t = time.perf_counter()
+        for move in moves:
+            cube.oneMove(move)
+        return time.perf_counter() - t
+    return run, len(moves)
+
+
+def benchMakeMoves(metodos, n, seed):
+    cube = Cube(n, compact=True, ids=False)
+    rng = np.random.RandomState(seed)
+    scrambles = [cube.shuffle(20, rng=rng) for _ in range(10)]
+
+    def run():
+        t = time.perf_counter()
+        for scramble in scrambles:
+            cube.makeMoves(scramble)
+        return time.perf_counter() - t
+    return run, len(scrambles)
+
+
+def benchMakeMovesCold(metodos, n, seed):
+    """
+    Same as makeMoves, but the caches of compiled moves are emptied before each run, so it measures the compilation of
+    the moves (as with scrambles that were never seen before) instead of the cache hits
+    """
+    cube = Cube(n, compact=True, ids=False)
+    rng = np.random.RandomState(seed)
+    scrambles = [cube.shuffle(20, rng=rng) for _ in range(10)]
+
+    def run():
+        compileMove.cache_clear()
+        compileMoves.cache_clear()
+        t = time.perf_counter()
+        for scramble in scrambles:
+            cube.makeMoves(scramble)
+        return time.perf_counter() - t
+    return run, len(scrambles)
+
+
+def benchEquivalent(metodos, n, seed):
+    cube = Cube(n, compact=True, ids=False)
+    rng = np.random.RandomState(seed)
+    positions = sorted({p for m in methodsWithConditions(metodos, n) for p in m.posiciones}) or ['-']
+    cases = [
+        (Face.FACES[rng.randint(6)], rng.randint(n), rng.randint(n), positions[rng.randint(len(positions))])
+        for _ in range(100)
+    ]
+
+    def run():
+        t = time.perf_counter()
+        for (face, row, column, position) in cases:
+            TAddress(cube, face, row, column).equivalent(position)
+        return time.perf_counter() - t
+    return run, len(cases)
+
+
+def benchMatchCubo(metodos, n, seed):
+    cube = Cube(n, compact=True, ids=False)
+    cube.shuffle(rng=np.random.RandomState(seed))
+    cases = [
+        (m.vars, met.cond2ListaCeldas(cube, cube.vars, m.listaCondiciones), m.posiciones)
+        for m in methodsWithConditions(metodos, n)
+    ]
+    if not cases:
+        return None
+
+    def run():
+        t = time.perf_counter()
+        for (vars, listaCeldas, posiciones) in cases:
+            met.matchCubo(cube, vars, listaCeldas, posiciones)
+        return time.perf_counter() - t
+    return run, len(cases)
+
+
+def benchCond2ListaCeldas(metodos, n, seed):
+    cube = Cube(n, compact=True, ids=False)
+    vars = Vars('c')
+    for v in 'ijk':
+        vars.set(v, 1)
+    conditions = [m.listaCondiciones for m in methodsWithConditions(metodos, n)]
+    if not conditions:
+        return None
+
+    def run():
+        t = time.perf_counter()
+        for listaCondiciones in conditions:
+            met.cond2ListaCeldas(cube, vars, listaCondiciones)
+        return time.perf_counter() - t
+    return run, len(conditions)
+
+
+def benchStandard(metodos, n, seed):
+    counter = [0]
+
+    def run():
+        cube = Cube(n, compact=True, ids=False)
+        cube.shuffle(rng=np.random.RandomState([seed, n, counter[0]]))
+        counter[0] = counter[0] + 1
+        metodos.vars.clear()
+        t = time.perf_counter()
+        met.ejecutarMetodo(cube, metodos.metodo('Standard'), [])
+        return time.perf_counter() - t
+    return run, 1
+
+
+BENCHMARKS = {
+    'oneMove': benchOneMove,
+    'makeMoves': benchMakeMoves,
+    'makeMovesCold': benchMakeMovesCold,
+    'equivalent': benchEquivalent,
+    'matchCubo': benchMatchCubo,
+    'cond2ListaCeldas': benchCond2ListaCeldas,
+    'Standard': benchStandard,
+}
+
+
+def measure(bench, metodos, n, seed, minTime):
+    """
+    Runs a benchmark for at least minTime seconds (after a warm up run) and then once more under tracemalloc.
+    The ops/sec are taken from the median run, so a few runs disturbed by the system don't change them much
+    :param bench: one of the functions of BENCHMARKS, returns (run, ops), where run() performs ops operations and
+                  returns the seconds they took, or None if there is nothing to measure for this size
+    :return: a dict with the results or None
+    """
+    prepared = bench(metodos, n, seed)
+    if prepared is None:
+        return None
+    run, ops = prepared
+    run()  # warm up (fills the caches, as in a long running solver)
+    times = []
+    while sum(times) < minTime or len(times) < 3:
+        times.append(run())
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'ops': len(times) * ops,
+        'seconds': round(sum(times), 6),
+        'opsPerSec': round(ops / float(np.median(times)), 3),
+        'peakBytes': peak // ops,
+    }
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the ratio new/old of the ops/sec of every benchmark present in both results
+    :return: the list of (bench, size, ratio) that got slower than 1 - threshold
+    """
+    old = {(r['bench'], r['size']): r for r in baseline['results']}
+    regressions = []
+    print(f'\ncompared with {baseline.get("commit")}:')
+    for r in results:
+        key = (r['bench'], r['size'])
+        if key not in old:
+            continue
+        ratio = r['opsPerSec'] / old[key]['opsPerSec']
+        mark = ' <-- slower' if ratio < 1 - threshold else ''
+        print(f'{r["bench"]:>18} {r["size"]:>3} {ratio:8.2f}x{mark}')
+        if mark:
+            regressions.append((r['bench'], r['size'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the solver hot paths')
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, default=list(range(2, 16)), help='cube sizes')
+    parser.add_argument('-b', '--bench', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('-m', '--methods', default='methods.json', help='JSON file with the solving methods')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random moves and scrambles')
+    parser.add_argument('--min-time', type=float, default=0.5, help='minimum seconds to run each benchmark')
+    parser.add_argument('-o', '--output', help='file to write the results (JSON)')
+    parser.add_argument('--compare', help='results of a previous run (JSON) to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown considered a regression (0.1 = 10%%)')
+    args = parser.parse_args(argv)
+
+    metodos = met.Metodos(args.methods)
+    results = []
+    print(f'{"bench":>18} {"n":>3} {"ops/sec":>12} {"peak KiB/op":>12}')
+    for name in args.bench:
+        for n in args.sizes:
+            measured = measure(BENCHMARKS[name], metodos, n, args.seed, args.min_time)
+            if measured is None:
+                continue
+            result = {'bench': name, 'size': n}
+            result.update(measured)
+            results.append(result)
+            print(f'{name:>18} {n:>3} {result["opsPerSec"]:12.1f} {result["peakBytes"] / 1024:12.1f}', flush=True)
+
+    report = {
+        'commit': gitCommit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=4)
+    if args.compare:
+        with open(args.compare) as infile:
+            if compare(results, json.load(infile), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
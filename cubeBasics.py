@@ -1,8 +1,10 @@
 # Basic data structures and processes of a Rubik's cube
 from __future__ import annotations
+from collections import namedtuple
+from functools import lru_cache
 import numpy as np
 
-from util import stripWords, firstAndRest, Vars
+from util import stripWords, firstAndRest, Vars, evalExpr
 
 
 # Directions
@@ -77,18 +79,8 @@ class Span:
         """
         if strSpan == "":
             beg, end = 0, cube.n - 1
-        elif ':' in strSpan:
-            beg, end = strSpan.split(':')
-            beg = eval(beg, cube.vars.vars()) - 1
-            end = eval(end, cube.vars.vars()) - 1
-            if beg > end:
-                beg, end = end, beg
         else:
-            beg = eval(strSpan, cube.vars.vars()) - 1
-            end = beg
-        if checkLimits:
-            beg = 0 if beg < 0 else cube.n - 1 if beg >= cube.n else beg
-            end = 0 if end < 0 else cube.n - 1 if end >= cube.n else end
+            beg, end = parseSpan(cube.n, strSpan, checkLimits, usedIJK(cube, strSpan))
         self.cube = cube
         self.beg = beg
         self.end = end
@@ -145,6 +137,19 @@ class Face:
         RIGHT: "blue"
     }
 
+    NORMAL = {  # outward normal of each face (x to the right, y up, z to the front)
+        FRONT: (0, 0, 1),
+        BACK: (0, 0, -1),
+        UP: (0, 1, 0),
+        DOWN: (0, -1, 0),
+        LEFT: (-1, 0, 0),
+        RIGHT: (1, 0, 0)
+    }
+
+    INDEX = {face: i for i, face in enumerate(FACES)}  # position of each face inside the state arrays of a Cube
+    COLORS = tuple(map(COLOR.get, FACES))  # color names indexed by their numeric code
+    COLOR_CODE = {color: code for code, color in enumerate(COLORS)}
+
 
 class Tile:
     """
@@ -172,6 +177,8 @@ class Connection:
 
 
 class ColorRel:
+    RELS = 'aco'
+
     def __init__(self, cube):
         """
         Holds the relationship between the colors of the cube
@@ -179,54 +186,32 @@ class ColorRel:
             'a' = anticlockwise
             'c' = clockwise
             'o' = opposite
+        The relationships only depend on the color of each face (read from the cube, that has to be solved), they are
+        computed from the geometry of the faces (see colorRelTables) and shared by all the cubes with the same colors
         :param cube: the cube to be inspected
         """
-        self._colorRel = {}
-        for _ in range(4):
-            colorList = [
-                cube.faces[Face.UP][cube.n - 1, cube.n - 1].color,  # clockwise top right corner
-                cube.faces[Face.RIGHT][0, 0].color,
-                cube.faces[Face.FRONT][0, cube.n - 1].color
-            ]
-            self.setRelColor('c', colorList)
-            colorList.reverse()
-            self.setRelColor('a', colorList)  # anticlockwise same corner
-            colorList = [
-                cube.faces[Face.UP][cube.n - 1, 0].color,  # clockwise top left corner
-                cube.faces[Face.FRONT][0, 0].color,
-                cube.faces[Face.LEFT][0, cube.n - 1].color
-            ]
-            self.setRelColor('c', colorList)
-            colorList.reverse()
-            self.setRelColor('a', colorList)  # anticlockwise same corner
-            cube.makeMoves('X')  # after 4 moves the cube returns to the original position
-        for color in self._colorRel:
-            opposite = ''
-            for ccc in self._colorRel:
-                if (ccc != color) and (ccc not in self._colorRel[color]['c']):
-                    opposite = ccc
-            self.setRelColor('o', [color, opposite])
-
-    def setRelColor(self, rel, colorList):
-        """
-        Updates the dict _colorRel to build the structure that hold all the relationships
-        :param rel: type of relationship ('a' = anticlockwise, 'c' = clockwise, 'o' = opposite)
-        :param colorList: list of the colors that have the relationship 'rel' between them
-        """
-        for c in range(len(colorList)):
-            d = self._colorRel
-            i = c
-            if colorList[i] not in d:
-                d[colorList[i]] = {}
-            d = d[colorList[i]]
-            for _ in range(1, len(colorList)):
-                if rel not in d:
-                    d[rel] = {}
-                d = d[rel]
-                i = (i + 1) if i < len(colorList) - 1 else 0
-                if colorList[i] not in d:
-                    d[colorList[i]] = {}
-                d = d[colorList[i]]
+        self.scheme = tuple(cube.color(face, 0, 0) for face in Face.FACES)
+        self._masks = colorRelTables(self.scheme)
+
+    def mask(self, rel, color1, color2=None):
+        """
+        Same as listColors, but the colors are returned as a bitmask of their codes (bit Face.COLOR_CODE[color])
+        :return: an int, 0 if there isn't any color with that relationship
+        """
+        code1 = Face.COLOR_CODE.get(color1)
+        if code1 is None or rel not in self._masks:
+            return 0
+        if not color2:
+            return self._masks[rel][code1][len(Face.COLORS)]
+        code2 = Face.COLOR_CODE.get(color2)
+        return 0 if code2 is None else self._masks[rel][code1][code2]
+
+    def isRelated(self, rel, color, color1, color2=None):
+        """
+        :return: True if 'color' is one of the colors of listColors(rel, color1, color2)
+        """
+        code = Face.COLOR_CODE.get(color)
+        return code is not None and (self.mask(rel, color1, color2) >> code) & 1 == 1
 
     def listColors(self, rel, color1, color2=None):
         """
@@ -237,21 +222,41 @@ class ColorRel:
         :param color2: (optional) the name of the second color
         :return: the list of colors that have this relationship with color1 and optionally color2
         """
-        d = self._colorRel
-        if color1 not in d:
-            return []
-        d = d[color1]
-        if rel not in d:
-            return []
-        d = d[rel]
-        if color2:
-            if color2 not in d:
-                return []
-            d = d[color2]
-            if rel not in d:
-                return []
-            d = d[rel]
-        return list(d.keys())
+        mask = self.mask(rel, color1, color2)
+        return [color for code, color in enumerate(Face.COLORS) if (mask >> code) & 1]
+
+
+@lru_cache(maxsize=None)
+def colorRelTables(scheme):
+    """
+    Bitmask tables of the relationships between the colors of a cube (see ColorRel), the results are cached.
+    Three faces that share a corner, listed in clockwise order (looking at the corner from outside the cube), have
+    normals with a negative determinant, ie U, R, F. So for each relationship:
+        'c': color1 -> the 4 colors of the adjacent faces, (color1, color2) -> the color that completes the corner
+             (color1, color2, color3) in clockwise order, if color2 is adjacent to color1
+        'a': the same, in anticlockwise order
+        'o': color1 -> the color of the opposite face, (color1, color2) -> nothing (there's no corner)
+    :param scheme: tuple with the name of the color of each face, in the order of Face.FACES
+    :return: a dict {rel: table}, table[code1][code2] is the bitmask of the color codes related with the colors of
+             codes code1 and code2 (code2 = len(Face.COLORS) when there isn't a second color)
+    """
+    none = len(Face.COLORS)
+    normals = np.array([Face.NORMAL[face] for face in Face.FACES])
+    codes = [Face.COLOR_CODE[color] for color in scheme]
+    tables = {rel: [[0] * (none + 1) for _ in range(none)] for rel in ColorRel.RELS}
+    for f1, f2 in np.ndindex(6, 6):
+        if normals[f1] @ normals[f2] == -1:
+            tables['o'][codes[f1]][none] |= 1 << codes[f2]
+    for f1, f2, f3 in np.ndindex(6, 6, 6):
+        if normals[f1] @ normals[f2] or normals[f1] @ normals[f3] or normals[f2] @ normals[f3]:
+            continue  # the three faces don't share a corner
+        rel = 'c' if np.linalg.det(normals[[f1, f2, f3]]) < 0 else 'a'
+        tables[rel][codes[f1]][codes[f2]] |= 1 << codes[f3]
+        tables[rel][codes[f1]][none] |= 1 << codes[f2]
+    return {rel: tuple(map(tuple, table)) for rel, table in tables.items()}
+
+
+ParsedMove = namedtuple('ParsedMove', 'face beg end direction times')  # immutable result of parsing a move
 
 
 class Move:
@@ -302,6 +307,25 @@ class Move:
         :param cube: the Cube object from where to take the size and vars
         :param mov: the string with the move to perform, coded as explained above
         """
+        parsed = parseMove(cube.n, mov, usedIJK(cube, mov))
+        self.cube = cube
+        self.face = parsed.face
+        self.span = Span(cube)
+        self.span.beg, self.span.end = parsed.beg, parsed.end
+        self.direction = Dir(parsed.direction)
+        self.times = parsed.times
+
+    def __repr__(self):
+        return f'{self.face}.{self.span}.{self.times if self.times != 1 else ""}{self.direction}'
+
+    @staticmethod
+    def parse(cube, mov) -> ParsedMove:
+        """
+        Parses the string 'mov' (see Move.__init__), use the cached function parseMove instead of calling it directly
+        :param cube: the Cube object from where to take the size and vars
+        :param mov: the string with the move to perform
+        :return: a ParsedMove record
+        """
         mm = mov
         face, span, direction, times = '', Span(cube), Dir(Dir.NULL), 0
 
@@ -380,14 +404,7 @@ class Move:
             elif direction.horizontal():  # LEFT or RIGHT
                 direction.invert()
 
-        self.cube = cube
-        self.face = face
-        self.span = span
-        self.direction = direction
-        self.times = times
-
-    def __repr__(self):
-        return f'{self.face}.{self.span}.{self.times if self.times != 1 else ""}{self.direction}'
+        return ParsedMove(face, span.beg, span.end, direction.id, times)
 
 
 class TAddress:
@@ -438,7 +455,20 @@ class TAddress:
         """
         Converts the address of the tile (face, row, column) to its equivalent for a given cube position, in other
         words, it calculates where the tile would be if the opposite moves to those in the 'position' parameter
-        were applied.
+        were applied. Uses the lookup table of the position (see equivalentTable).
+        Change the object in place and returns a pointer to itself (useful for chaining method calls).
+
+        :param position: The list of moves that bring the cube to the desired position. Supported moves are: FBLRUD XYZ + ' + 2.
+        :return: The modified object.
+        """
+        table = equivalentTable(self.cube.n, position)
+        self.f, self.r, self.c = self.cube.address(table[self.cube.index(self.f, self.r, self.c)])
+        return self
+
+    def walkEquivalent(self, position):
+        """
+        Same as 'equivalent' but walking the faces of the cube move by move, tile by tile, instead of using a
+        lookup table (it's used to build the tables when the position has moves other than FBLRUD XYZ + ' + 2).
         Change the object in place and returns a pointer to itself (useful for chaining method calls).
 
         :param position: The list of moves that bring the cube to the desired position. Supported moves are: FBLRUD XYZ + ' + 2.
@@ -530,15 +560,63 @@ class TAddress:
         return self
 
 
+class CubeState:
+    """
+    Immutable snapshot of the colors of a cube (see Cube.stateKey), hashable and comparable: two states are equal if
+    they are of the same size and have the same colors in every position. The hash is the Zobrist hash of the cube.
+    """
+    __slots__ = ('n', 'colors', 'zobrist')
+
+    def __init__(self, n, colors, zobrist):
+        self.n = n
+        self.colors = colors  # bytes with the color code of every position
+        self.zobrist = zobrist
+
+    def __hash__(self):
+        return self.zobrist
+
+    def __eq__(self, other):
+        return isinstance(other, CubeState) and self.zobrist == other.zobrist and self.n == other.n \
+            and self.colors == other.colors
+
+    def __repr__(self):
+        return f'CubeState({self.n}, {self.zobrist:016x})'
+
+
+class CubeSnapshot:
+    """
+    Copy of the state arrays of a cube (see Cube.snapshot), to bring the cube back to this state with Cube.restore.
+    The Tile objects are not copied, only their ids, so the tiles (and whatever is attached to them) stay in place.
+    """
+    __slots__ = ('n', 'colors', 'ids', 'tileIds', 'zobrist')
+
+    def __init__(self, n, colors, ids, tileIds, zobrist):
+        self.n = n
+        self.colors = colors  # copy of the color codes
+        self.ids = ids  # copy of the sticker ids of a compact cube (or None)
+        self.tileIds = tileIds  # object array with the id of every Tile of a regular cube (or None)
+        self.zobrist = zobrist
+
+    def __repr__(self):
+        return f'CubeSnapshot({self.n})'
+
+
 class Cube:
-    def __init__(self, size=3, white=False):
+    def __init__(self, size=3, white=False, compact=False, ids=True):
         """
         Holds the data structure and transformations of a regular 6 faces Rubik's cube
+        The state of the cube is held in flat arrays of 6 * size * size positions (the faces in the order of Face.FACES,
+        each one stored row by row). Every cube keeps the numeric color codes (see Face.COLORS) in 'colors', a regular
+        cube also keeps a Tile object for each position in 'tiles' (the graphic interface attaches its actors to them),
+        a compact cube only keeps numeric arrays, so it's much lighter and faster to move and to copy.
         :param size: each face of the cube will have (size x size) tiles
         :param white: True if it's a cube with all white tiles (useful when you're building the solving methods database)
+        :param compact: True to hold the state only in numeric arrays, in this case faces[face][r, c] is the color code
+        :param ids: (compact cubes only) True to keep also an array with the original position of each sticker
         """
         self.n = size
         self.white = white
+        self.compact = compact
 
         self.vars = Vars('c')  # Variables to convert logic coordinates to numeric ones
         self.vars.set('T', 1)
@@ -555,15 +633,17 @@ class Cube:
         self.vars.set('j', 0)
         self.vars.set('k', 0)
 
-        # create the faces dict, each face is an array of tiles
-        self.faces = {
-            Face.FRONT: np.array([[Tile() for _ in range(self.n)] for _ in range(self.n)]),
-            Face.BACK: np.array([[Tile() for _ in range(self.n)] for _ in range(self.n)]),
-            Face.UP: np.array([[Tile() for _ in range(self.n)] for _ in range(self.n)]),
-            Face.DOWN: np.array([[Tile() for _ in range(self.n)] for _ in range(self.n)]),
-            Face.LEFT: np.array([[Tile() for _ in range(self.n)] for _ in range(self.n)]),
-            Face.RIGHT: np.array([[Tile() for _ in range(self.n)] for _ in range(self.n)])
-        }
+        # create the state arrays, and the faces dict, each face is a (n x n) view of the tiles (or the color codes
+        # in a compact cube). Every move is performed on all the layers of the state at the same time
+        size = 6 * self.n * self.n
+        self.colors = np.zeros(size, dtype=np.uint8)
+        if self.compact:
+            self.tiles = None
+            self.ids = np.zeros(size, dtype=np.uint32) if ids else None
+        else:
+            self.tiles = np.array([Tile() for _ in range(size)])
+            self.ids = None
+        self.faces = self.faceViews(self.layers()[0])
         self.initTiles()
 
         # Connections between adjacent faces of the cube. Which one connects with which other, through which edge,
@@ -616,22 +696,150 @@ class Cube:
         if not self.white:
             self.colorRel = ColorRel(self)
 
+    def layers(self):
+        """
+        :return: the list of flat arrays that hold the state of the cube (tiles, color codes, sticker ids)
+        """
+        return [layer for layer in (self.tiles, self.colors, self.ids) if layer is not None]
+
+    def faceViews(self, layer):
+        """
+        Splits a flat state array in its faces
+        :param layer: array of 6 * n * n positions
+        :return: a dict with a (n x n) view of the layer for each face
+        """
+        layer = layer.reshape(6, self.n, self.n)
+        return {face: layer[Face.INDEX[face]] for face in Face.FACES}
+
+    def index(self, face, row, column):
+        """
+        :return: the position of the tile (face, row, column) inside the flat state arrays
+        """
+        return (Face.INDEX[face] * self.n + row) * self.n + column
+
+    def address(self, index):
+        """
+        :return: the tuple (face, row, column) of a position inside the flat state arrays (the inverse of 'index')
+        """
+        face, rc = divmod(int(index), self.n * self.n)
+        return (Face.FACES[face],) + divmod(rc, self.n)
+
+    def color(self, face, row, column):
+        """
+        :return: the name of the color of the tile (face, row, column), no matter if it's a compact cube or not
+        """
+        return Face.COLORS[self.colors[self.index(face, row, column)]]
+
     def initTiles(self):
         """
         Initializes all the tiles of a cube with the color that corresponds to each face
         """
-        for face in self.faces:
-            for r in range(self.n):
-                for c in range(self.n):
-                    self.faces[face][r, c].color = Face.COLOR[face] if not self.white else 'white'
-                    self.faces[face][r, c].id = f'{face}.{r+1}.{c+1}'
+        for face in Face.FACES:
+            self.colors.reshape(6, -1)[Face.INDEX[face]] = Face.COLOR_CODE[Face.COLOR[face] if not self.white else 'white']
+        if self.ids is not None:
+            self.ids[:] = np.arange(self.ids.size)
+        if self.tiles is not None:
+            for face in self.faces:
+                for r in range(self.n):
+                    for c in range(self.n):
+                        self.faces[face][r, c].color = Face.COLOR[face] if not self.white else 'white'
+                        self.faces[face][r, c].id = f'{face}.{r+1}.{c+1}'
+        self.rehash()
+
+    def rehash(self):
+        """
+        Forgets the hash of the state (see stateHash), it's called by every method that changes the state, call it
+        if you change 'colors' directly
+        """
+        self._zobrist = None
+
+    def stateHash(self):
+        """
+        64 bits Zobrist hash of the colors of the cube: the xor of a random number for each (position, color). Two cubes
+        of the same size with the same colors in every position have the same hash. The moves only mark the hash as
+        outdated, it's computed (with a single gather and xor over the state) the first time it's asked after a change.
+        :return: an int
+        """
+        if self._zobrist is None:
+            table = zobristTable(self.n)
+            self._zobrist = int(np.bitwise_xor.reduce(table[np.arange(self.colors.size), self.colors]))
+        return self._zobrist
+
+    def stateKey(self):
+        """
+        :return: an immutable and hashable copy of the state of the cube (see CubeState), to use as key in dicts and sets
+        """
+        return CubeState(self.n, self.colors.tobytes(), self.stateHash())
+
+    def sameState(self, other):
+        """
+        :return: True if the other cube has the same size and the same colors in every position
+        """
+        return self.n == other.n and self.stateHash() == other.stateHash() and np.array_equal(self.colors, other.colors)
+
+    def applyPerm(self, perm):
+        """
+        Moves all the layers of the state with a permutation: state = state[perm]
+        :param perm: a permutation of the positions of the flat state arrays (see compileMove, compileMoves)
+        """
+        for layer in self.layers():
+            layer[:] = layer[perm]
+        self._zobrist = None
+
+    def snapshot(self):
+        """
+        Copies the state of the cube, much cheaper than building a new cube (see restore)
+        :return: a CubeSnapshot
+        """
+        tileIds = None
+        if self.tiles is not None:
+            tileIds = np.array([tile.id for tile in self.tiles], dtype=object)
+        return CubeSnapshot(self.n, self.colors.copy(), None if self.ids is None else self.ids.copy(), tileIds,
+                            self._zobrist)
+
+    def restore(self, snapshot):
+        """
+        Brings the cube back to the state of a snapshot taken with the method snapshot (of this or other cube of the
+        same size). The Tile objects of a regular cube are kept in their positions, only their id and color change
+        :param snapshot: a CubeSnapshot
+        """
+        if snapshot.n != self.n:
+            raise ValueError(f'Snapshot of a {snapshot.n}x{snapshot.n} cube on a {self.n}x{self.n} cube')
+        self.colors[:] = snapshot.colors
+        if self.ids is not None and snapshot.ids is not None:
+            self.ids[:] = snapshot.ids
+        if self.tiles is not None:
+            tileIds = snapshot.tileIds
+            if tileIds is None:  # snapshot of a compact cube: the ids are rebuilt from the sticker numbers
+                tileIds = [f'{face}.{r + 1}.{c + 1}' for face, r, c in map(self.address, snapshot.ids)] \
+                    if snapshot.ids is not None else [tile.id for tile in self.tiles]
+            for tile, tileId, code in zip(self.tiles, tileIds, self.colors):
+                tile.id = tileId
+                tile.color = Face.COLORS[code]
+        self._zobrist = snapshot.zobrist
+
+    def isSolved(self):
+        """
+        :return: True if every face of the cube has a single color
+        """
+        faces = self.colors.reshape(6, -1)
+        return bool((faces == faces[:, :1]).all())
 
     def makeMoves(self, sMoves, backwards=False):
         """
-        Parses the moves in sMoves with the method "str2move" and make them.
+        Makes all the moves in sMoves at once, the whole string is compiled (and cached) as a single permutation
         :param sMoves: string containing one or more moves separated by spaces
         :param backwards: if True, start from the end and make all the moves backwards
         """
+        self.applyPerm(compileMoves(self.n, sMoves, backwards, usedIJK(self, sMoves)))
+
+    def parseMoves(self, sMoves, backwards=False):
+        """
+        Parses the moves in sMoves, taking in account the mirror marks ('><') and the empty moves ('-')
+        :param sMoves: string containing one or more moves separated by spaces
+        :param backwards: if True, start from the end and invert all the moves
+        :return: an iterator of Move objects
+        """
         moves = stripWords(sMoves)
         if backwards:
             moves.reverse()
@@ -645,9 +853,10 @@ class Cube:
             move = Move(cube=self, mov=mirror + m)
             if backwards:
                 move.direction.invert()
-            self.oneMove(move)
+            yield move
 
-    def readWriteTiles(self, face, span: Span, direction: Dir, tiles=None, changedTiles=None):
+    def readWriteTiles(self, face, span: Span, direction: Dir, tiles=None, changedTiles=None, faces=None,
+                       changedIndexes=None):
         """
         Reads (and optionally replaces) a range of tiles from the matrix of a cube face.
 
@@ -658,21 +867,27 @@ class Cube:
         :param tiles: (optional) Tiles that will replace the ones determined by the span and direction.
         :param changedTiles: (optional) If a list object is provided, adds to this list the addresses (TAddress objects)
                                 of all the modified tiles.
+        :param faces: (optional) The faces dict of the layer of the state to use, if None self.faces is used.
+        :param changedIndexes: (optional) If a list object is provided, adds to this list an array with the indexes
+                               (see index) of all the modified tiles, in the same order as changedTiles.
         :return: Returns a matrix with the read tiles
         """
+        faces = self.faces if faces is None else faces
         if direction.horizontal():  # LEFT or RIGHT
             rows = span.slice()
             cols = slice(None, None, direction.col)
         else:  # UP or DOWN
             rows = slice(None, None, direction.row)
             cols = span.slice()
-        ret = self.faces[face][rows, cols].copy()
+        ret = faces[face][rows, cols].copy()
         if tiles is not None:
-            self.faces[face][rows, cols] = tiles
+            faces[face][rows, cols] = tiles
             if changedTiles is not None:
                 changedTiles.extend(
                     TAddress(self, face, r, c) for r in range(*rows.indices(self.n)) for c in range(*cols.indices(self.n))
                 )
+            if changedIndexes is not None:
+                changedIndexes.append(positionFaces(self.n)[face][rows, cols].ravel())
         return ret
 
     def oneMove(self, move: Move, changedTiles=None):
@@ -683,12 +898,28 @@ class Cube:
         :param changedTiles: (optional) If a list object is provided, adds to this list the addresses (TAddress objects)
                                 of all the modified tiles.
         """
+        perm, moved = compileMove(self.n, move.face, move.span.beg, move.span.end, move.direction.id, move.times)
+        self.applyPerm(perm)
+        if changedTiles is not None:
+            changedTiles.extend(TAddress(self, *self.address(i)) for i in moved)
+
+    def moveLayer(self, faces, move: Move, changedTiles=None, changedIndexes=None):
+        """
+        Performs a move on one of the layers of the state of the cube (tiles, color codes or sticker ids).
+
+        :param faces: the faces dict of the layer to move
+        :param move: the move to perform
+        :param changedTiles: (optional) If a list object is provided, adds to this list the addresses (TAddress objects)
+                                of all the modified tiles.
+        :param changedIndexes: (optional) If a list object is provided, adds to this list arrays with the indexes of
+                               all the modified tiles (the same tiles as changedTiles, without building TAddress objects)
+        """
         for _ in range(move.times):
             ff, sp, dd = move.face, move.span, move.direction
 
             # copy the tile sector determined by 'span' and 'direction', on the different faces of the cube,
             # rotating 4 times in the given direction
-            tiles = self.readWriteTiles(ff, sp, dd)
+            tiles = self.readWriteTiles(ff, sp, dd, faces=faces)
             for _ in range(4):
                 conn = self.conn[ff][dd.id]
                 ff, dd = conn.face, conn.direct
@@ -696,7 +927,8 @@ class Cube:
                     sp.invert().swap()
                 if conn.transpose:
                     tiles = tiles.T
-                tiles = self.readWriteTiles(ff, sp, dd, tiles=tiles, changedTiles=changedTiles)
+                tiles = self.readWriteTiles(ff, sp, dd, tiles=tiles, changedTiles=changedTiles, faces=faces,
+                                            changedIndexes=changedIndexes)
 
             # When the range includes one or both edges, rotate the side faces, clockwise or anticlockwise.
             if move.span.beg == 0 or move.span.end == 0:
@@ -706,9 +938,11 @@ class Cube:
                 else:  # (direction == Dir.UP) or (direction == Dir.DOWN)
                     ff = self.conn[move.face][Dir.LEFT].face
                     rotDir = 1 if move.direction.id == Dir.UP else 3  # 1 = anticlockwise, 3 = clockwise
-                self.faces[ff] = np.rot90(self.faces[ff], rotDir)
+                faces[ff][...] = np.rot90(faces[ff], rotDir)  # in place, the faces are views of the state
                 if changedTiles is not None:
                     changedTiles.extend([TAddress(self, ff, r, c) for r in range(self.n) for c in range(self.n)])
+                if changedIndexes is not None:
+                    changedIndexes.append(positionFaces(self.n)[ff].ravel())
             if move.span.beg == self.n - 1 or move.span.end == self.n - 1:
                 if move.direction.horizontal():  # Dir.RIGHT or Dir.LEFT
                     ff = self.conn[move.face][Dir.DOWN].face
@@ -716,9 +950,11 @@ class Cube:
                 else:  # (direction == Dir.UP) or (direction == Dir.DOWN)
                     ff = self.conn[move.face][Dir.RIGHT].face
                     rotDir = 1 if move.direction.id == Dir.DOWN else 3  # 1 = anticlockwise, 3 = clockwise
-                self.faces[ff] = np.rot90(self.faces[ff], rotDir)
+                faces[ff][...] = np.rot90(faces[ff], rotDir)  # in place, the faces are views of the state
                 if changedTiles is not None:
                     changedTiles.extend([TAddress(self, ff, r, c) for r in range(self.n) for c in range(self.n)])
+                if changedIndexes is not None:
+                    changedIndexes.append(positionFaces(self.n)[ff].ravel())
 
     def anticlockwiseFace(self, face, direction):
         """
@@ -760,22 +996,533 @@ class Cube:
         else:
             return None
 
-    def shuffle(self, qty=0):
+    def shuffle(self, qty=0, rng=None):
         """
         Shuffles the cube with "qty" random moves
         :param qty: Quantity of random moves to make. Default: 20n (n = the size of the cube)
+        :param rng: np.random.RandomState to draw the moves from, for reproducible shuffles. Default: np.random
         :return: a string with the movements performed
         """
+        if rng is None:
+            rng = np.random
         moves = []
         if qty <= 0:
             qty = self.n * 20
         move = Move(self, 'F')
         for _ in range(qty):
-            move.face = np.random.choice(list(Face.FACES))
-            move.span.beg, move.span.end = (np.random.randint(self.n), np.random.randint(self.n))
-            move.direction = Dir([Dir.UP, Dir.DOWN, Dir.LEFT, Dir.RIGHT][np.random.randint(4)])
-            move.times = np.random.randint(1, 4)
+            move.face = rng.choice(list(Face.FACES))
+            move.span.beg, move.span.end = (rng.randint(self.n), rng.randint(self.n))
+            move.direction = Dir([Dir.UP, Dir.DOWN, Dir.LEFT, Dir.RIGHT][rng.randint(4)])
+            move.times = rng.randint(1, 4)
             moves.append(str(move))
             self.oneMove(move)
         return ' '.join(moves)
 
+
+class CubeBatch:
+    def __init__(self, size=3, count=1, ids=False):
+        """
+        Holds the state of many compact cubes of the same size (see Cube) in a single 2D array, one row per cube, so the
+        same moves are made on all of them (or on a subset of them) with a single vectorized gather
+        :param size: each face of the cubes will have (size x size) tiles
+        :param count: the number of cubes, all of them start solved
+        :param ids: True to keep also an array with the original position of each sticker of each cube
+        """
+        template = Cube(size, compact=True, ids=ids)
+        self.n = size
+        self.vars = template.vars  # the values of i, j, k are shared by all the cubes
+        self.colorRel = template.colorRel
+        self.colors = np.tile(template.colors, (count, 1))
+        self.ids = np.tile(template.ids, (count, 1)) if ids else None
+
+    @classmethod
+    def fromCubes(cls, cubes):
+        """
+        :param cubes: a non empty list of cubes (regular or compact) of the same size
+        :return: a CubeBatch with a copy of the state of each cube
+        """
+        batch = cls(cubes[0].n, 0)
+        if any(cube.n != batch.n for cube in cubes):
+            raise ValueError('All the cubes of a batch must have the same size')
+        batch.colors = np.stack([cube.colors for cube in cubes])
+        return batch
+
+    def __len__(self):
+        return self.colors.shape[0]
+
+    def layers(self):
+        """
+        :return: the list of 2D arrays that hold the state of the cubes (color codes, sticker ids)
+        """
+        return [layer for layer in (self.colors, self.ids) if layer is not None]
+
+    def cube(self, index):
+        """
+        :return: a compact Cube with a copy of the state of the cube number index of the batch
+        """
+        return self.loadCube(index)
+
+    def loadCube(self, index, cube=None):
+        """
+        Copies the state of the cube number index of the batch into a compact Cube, to look at many cubes of the batch
+        one by one without creating a Cube for each of them
+        :param index: the number of the cube in the batch
+        :param cube: (optional) a compact Cube of the same size returned by a previous call, None to create a new one
+        :return: the compact Cube with a copy of the state
+        """
+        if cube is None:
+            cube = Cube(self.n, compact=True, ids=self.ids is not None)
+        cube.colors[:] = self.colors[index]
+        if self.ids is not None:
+            cube.ids[:] = self.ids[index]
+        for v in 'ijk':
+            cube.vars.set(v, self.vars.get(v))
+        cube.rehash()
+        return cube
+
+    def applyPerm(self, perm, which=None):
+        """
+        Moves the cubes with the same permutation: state = state[:, perm]
+        :param perm: a permutation of the positions of the flat state arrays (see compileMove, compileMoves)
+        :param which: (optional) boolean mask or array of indexes of the cubes to move, default: all of them
+        """
+        for layer in self.layers():
+            if which is None:
+                layer[:] = layer[:, perm]
+            else:
+                layer[which] = layer[which][:, perm]
+
+    def applyPerms(self, perms):
+        """
+        Moves each cube with its own permutation: state[b] = state[b, perms[b]]
+        :param perms: 2D array with a permutation for each cube of the batch
+        """
+        for layer in self.layers():
+            layer[:] = np.take_along_axis(layer, perms, axis=1)
+
+    def makeMoves(self, sMoves, backwards=False, which=None):
+        """
+        Makes the same moves in all the cubes (or in some of them), see Cube.makeMoves
+        :param sMoves: string containing one or more moves separated by spaces
+        :param backwards: if True, start from the end and make all the moves backwards
+        :param which: (optional) boolean mask or array of indexes of the cubes to move, default: all of them
+        """
+        self.applyPerm(compileMoves(self.n, sMoves, backwards, usedIJK(self, sMoves)), which)
+
+    def isSolved(self):
+        """
+        :return: a boolean array, True for each cube that has a single color in every face
+        """
+        faces = self.colors.reshape(len(self), 6, -1)
+        return (faces == faces[:, :, :1]).all(axis=(1, 2))
+
+    def stateHashes(self):
+        """
+        :return: an array with the Zobrist hash of each cube (the same as Cube.stateHash)
+        """
+        table = zobristTable(self.n)
+        return np.bitwise_xor.reduce(table[np.arange(self.colors.shape[1]), self.colors], axis=1)
+
+    def shuffle(self, qty=0, rng=None):
+        """
+        Shuffles each cube with its own "qty" random moves (drawn as in Cube.shuffle), one vectorized step per move
+        :param qty: Quantity of random moves to make. Default: 20n (n = the size of the cubes)
+        :param rng: np.random.RandomState to draw the moves from, for reproducible shuffles. Default: np.random
+        :return: the list of the strings with the movements performed in each cube
+        """
+        if rng is None:
+            rng = np.random
+        if qty <= 0:
+            qty = self.n * 20
+        count = len(self)
+        moves = []  # the names of the moves of each step, for all the cubes
+        move = Move(templateCube(self.n), 'F')
+        directions = [Dir.UP, Dir.DOWN, Dir.LEFT, Dir.RIGHT]
+        for _ in range(qty):
+            drawn = np.stack([
+                rng.randint(6, size=count), rng.randint(self.n, size=count), rng.randint(self.n, size=count),
+                rng.randint(4, size=count), rng.randint(1, 4, size=count)
+            ], axis=1)
+            unique, inverse = np.unique(drawn, axis=0, return_inverse=True)
+            perms, names = [], []
+            for face, beg, end, direction, times in unique.tolist():
+                move.face, move.span.beg, move.span.end = Face.FACES[face], beg, end
+                move.direction, move.times = Dir(directions[direction]), times
+                perms.append(compileMove(self.n, move.face, beg, end, move.direction.id, times)[0])
+                names.append(str(move))
+            inverse = inverse.reshape(-1)
+            self.applyPerms(np.stack(perms)[inverse])
+            moves.append(np.array(names, dtype=object)[inverse])
+        return [' '.join(m) for m in zip(*moves)]
+
+
+@lru_cache(maxsize=None)
+def positionFaces(n):
+    """
+    :return: the faces dict (see Cube.faceViews) of an array with the index of each position of a cube of size n,
+             to read the indexes of any range of tiles by slicing it, the results are cached
+    """
+    positions = np.arange(6 * n * n)
+    positions.flags.writeable = False
+    positions = positions.reshape(6, n, n)
+    return {face: positions[Face.INDEX[face]] for face in Face.FACES}
+
+
+@lru_cache(maxsize=4096)
+def compileMove(n, face, beg, end, direction, times):
+    """
+    Compiles a move into a permutation of the positions of the flat state arrays of a cube of size n, so the move is
+    performed with a single gather: state = state[perm]. The permutation is obtained by moving an array of positions
+    with the tile by tile algorithm (Cube.moveLayer), the results are cached.
+
+    :param n: the size of the cube
+    :param face: the base face of the move (Move.face)
+    :param beg: first row/column to move (Move.span.beg)
+    :param end: last row/column to move (Move.span.end)
+    :param direction: the id of the direction of the move (Move.direction.id)
+    :param times: the number of times to repeat the move
+    :return: a tuple (perm, moved), perm is the permutation, moved are the positions of all the modified tiles, listed
+             once for each repetition of the move (just as oneMove reports them in changedTiles)
+    """
+    cube = templateCube(n)
+    move = Move(cube, 'F')
+    move.face, move.span.beg, move.span.end, move.direction, move.times = face, beg, end, Dir(direction), times
+    perm = np.arange(6 * n * n)
+    changedIndexes = []
+    cube.moveLayer(cube.faceViews(perm), move, changedIndexes=changedIndexes)
+    moved = np.concatenate(changedIndexes).astype(perm.dtype) if changedIndexes else np.zeros(0, dtype=perm.dtype)
+    perm.flags.writeable = moved.flags.writeable = False  # shared by every cube of this size
+    return perm, moved
+
+
+@lru_cache(maxsize=1024)
+def compileMoves(n, sMoves, backwards=False, ijk=None):
+    """
+    Compiles a string of moves into a single permutation of the positions of the flat state arrays of a cube of size n,
+    composing the permutations of each move (see compileMove), the results are cached.
+
+    :param n: the size of the cube
+    :param sMoves: string containing one or more moves separated by spaces (see Cube.parseMoves)
+    :param backwards: if True, start from the end and make all the moves backwards
+    :param ijk: values of the variables i, j, k to use in the moves (None if they aren't used)
+    :return: the permutation
+    """
+    cube = templateCube(n)
+    templateVars(n, ijk)
+    perm = np.arange(6 * n * n)
+    for move in cube.parseMoves(sMoves, backwards):
+        perm = perm[compileMove(n, move.face, move.span.beg, move.span.end, move.direction.id, move.times)[0]]
+    perm.flags.writeable = False
+    return perm
+
+
+def usedIJK(cube, string):
+    """
+    The variables i, j, k are the only ones that can change for a given cube size, so they have to be part of the key
+    of the caches of parsed strings, but only if they are used in the string
+    :return: a tuple with the values of i, j, k of the cube or None if the string doesn't use them
+    """
+    return tuple(cube.vars.get(v) for v in 'ijk') if any(v in string for v in 'ijk') else None
+
+
+def templateVars(n, ijk):
+    """
+    :return: the dict of vars of the template cube of size n, with the values of i, j, k set (if not None)
+    """
+    cube = templateCube(n)
+    if ijk is not None:
+        for var, value in zip('ijk', ijk):
+            cube.vars.set(var, value)
+    return cube.vars.vars()
+
+
+@lru_cache(maxsize=4096)
+def parseSpan(n, strSpan, checkLimits=True, ijk=None):
+    """
+    Converts a string with a range of rows/columns to its limits (see Span), the results are cached
+    :param n: the size of the cube
+    :param strSpan: string containing a range with the form <begin>[:<end>]
+    :param checkLimits: True if it's necessary to check if <begin> and <end> are between 0 and n-1
+    :param ijk: values of the variables i, j, k to use (None if they aren't used)
+    :return: the tuple (beg, end), zero based
+    """
+    names = templateVars(n, ijk)
+    if ':' in strSpan:
+        beg, end = strSpan.split(':')
+        beg = evalExpr(beg, names) - 1
+        end = evalExpr(end, names) - 1
+        if beg > end:
+            beg, end = end, beg
+    else:
+        beg = evalExpr(strSpan, names) - 1
+        end = beg
+    if checkLimits:
+        beg = 0 if beg < 0 else n - 1 if beg >= n else beg
+        end = 0 if end < 0 else n - 1 if end >= n else end
+    return beg, end
+
+
+@lru_cache(maxsize=4096)
+def parseMove(n, mov, ijk=None):
+    """
+    Parses a move (see Move) for a cube of size n, the results are cached
+    :param n: the size of the cube
+    :param mov: the string with the move
+    :param ijk: values of the variables i, j, k to use (None if they aren't used)
+    :return: a ParsedMove record
+    """
+    templateVars(n, ijk)
+    return Move.parse(templateCube(n), mov)
+
+
+@lru_cache(maxsize=1024)
+def equivalentTable(n, position):
+    """
+    Lookup table of TAddress.equivalent for a position of a cube of size n: table[index] is the index of the equivalent
+    of the tile in that index (indexes of the flat state arrays, see Cube.index), the results are cached.
+    Looking at the tiles of the cube through the equivalent addresses is the same as looking at the tiles of the cube
+    moved to that position, so the table is the permutation of the position moves, unless the position has
+    unsupported moves, in that case the table is built walking the cube tile by tile.
+
+    :param n: the size of the cube
+    :param position: The list of moves that bring the cube to the desired position.
+    :return: the table, an array of 6 * n * n indexes
+    """
+    if position == '-':
+        position = ''
+    if all(m[0] in 'FBLRUDXYZ' and set(m[1:]) <= set("'2") for m in stripWords(position)):
+        return compileMoves(n, position)
+    cube = templateCube(n)
+    table = np.array([
+        cube.index(t.f, t.r, t.c)
+        for t in (TAddress(cube, *cube.address(i)).walkEquivalent(position) for i in range(6 * n * n))
+    ])
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=None)
+def zobristTable(n):
+    """
+    Random numbers of the Zobrist hash of a cube of size n (see Cube.stateHash), always the same for a given size
+    :return: an array (6 * n * n positions x len(Face.COLORS) colors) of 64 bits random numbers
+    """
+    table = np.random.RandomState(n).randint(0, 2 ** 64, size=(6 * n * n, len(Face.COLORS)), dtype=np.uint64)
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=None)
+def templateCube(n):
+    """
+    :return: a compact white cube of size n, to be used as a reference to parse and compile moves
+    """
+    return Cube(n, white=True, compact=True, ids=False)
+
+
+# Canonical axes used to describe the moves as turns of layers: (face, direction) of a single layer quarter turn.
+# x: layers from the left face to the right one, turning as R.  y: from the upper face down, turning as U'.
+# z: from the front face to the back one, turning as F
+AXES = ((Face.FRONT, Dir.UP), (Face.FRONT, Dir.LEFT), (Face.RIGHT, Dir.DOWN))
+
+
+@lru_cache(maxsize=None)
+def layerTurns(n):
+    """
+    Permutations of the quarter turns of every single layer of a cube of size n around each axis (see AXES)
+    :param n: the size of the cube
+    :return: a tuple (perms, moved), perms[axis][layer][q] is the permutation of q quarter turns of the layer
+             (q = 0..3), moved[axis][layer] are the positions moved by the layer
+    """
+    identity = np.arange(6 * n * n)
+    perms, moved = [], []
+    for face, direction in AXES:
+        perms.append([]), moved.append([])
+        for k in range(n):
+            quarter = compileMove(n, face, k, k, direction, 1)[0]
+            turns = [identity, quarter]
+            for _ in range(2):
+                turns.append(turns[-1][quarter])
+            perms[-1].append(turns)
+            moved[-1].append(np.flatnonzero(quarter != identity))
+    return perms, moved
+
+
+def turnsPerm(n, axis, turns):
+    """
+    :return: the permutation of turning each layer k of the cube turns[k] quarter turns around the axis
+    """
+    perms = layerTurns(n)[0][axis]
+    perm = np.arange(6 * n * n)
+    for k, q in enumerate(turns):
+        if q:
+            perm = perm[perms[k][q]]
+    return perm
+
+
+def decodePerm(n, perm):
+    """
+    Describes a permutation of a cube of size n as turns of the layers around one of the axes (see AXES)
+    :param n: the size of the cube
+    :param perm: the permutation of a single move (it must turn layers around a single axis)
+    :return: a tuple (axis, turns), turns[k] are the quarter turns of layer k, or None if the permutation is the identity
+    """
+    if (perm == np.arange(perm.size)).all():
+        return None
+    perms, moved = layerTurns(n)
+    for axis in range(len(AXES)):
+        turns = []
+        for k in range(n):
+            q = next((q for q in range(4) if np.array_equal(perm[moved[axis][k]], perms[axis][k][q][moved[axis][k]])), None)
+            if q is None:
+                break
+            turns.append(q)
+        if len(turns) == n and np.array_equal(turnsPerm(n, axis, turns), perm):
+            return axis, tuple(turns)
+    raise ValueError('the permutation is not a move of layers around an axis')
+
+
+@lru_cache(maxsize=4096)
+def decodeMove(n, face, beg, end, direction, times):
+    """
+    Cached decodePerm of a move (see compileMove for the parameters)
+    """
+    return decodePerm(n, compileMove(n, face, beg, end, direction, times)[0])
+
+
+@lru_cache(maxsize=None)
+def cubeRotations(n):
+    """
+    The 24 orientations of a cube of size n, reached with whole cube rotations (X, Y, Z)
+    :return: a dict: bytes of the permutation of the orientation -> (permutation, shortest string of rotations)
+    """
+    generators = [(r, compileMoves(n, r)) for r in ('X', "X'", 'X2', 'Y', "Y'", 'Y2', 'Z', "Z'", 'Z2')]
+    identity = np.arange(6 * n * n)
+    rotations = {identity.tobytes(): (identity, '')}
+    pending = [identity]
+    while pending:
+        perm = pending.pop(0)
+        for r, rPerm in generators:
+            newPerm = perm[rPerm]
+            if newPerm.tobytes() not in rotations:
+                rotations[newPerm.tobytes()] = (newPerm, (rotations[perm.tobytes()][1] + ' ' + r).strip())
+                pending.append(newPerm)
+    return rotations
+
+
+@lru_cache(maxsize=None)
+def rotationConjugates(n, rotation):
+    """
+    How the layers are relabelled when a whole cube rotation is moved after a move: 'rotation, move' is the same as
+    'conjugated move, rotation'
+    :param n: the size of the cube
+    :param rotation: bytes of the permutation of the rotation (a key of cubeRotations)
+    :return: a tuple with an item (axis, layers, q) for each axis: the conjugated move turns layers[k] of the new
+             axis q quarter turns for every quarter turn of layer k
+    """
+    rPerm = cubeRotations(n)[rotation][0]
+    inverse = np.argsort(rPerm)
+    conjugates = []
+    for axis in range(len(AXES)):
+        layers, sign = [], 1
+        for k in range(n):
+            newAxis, turns = decodePerm(n, rPerm[layerTurns(n)[0][axis][k][1]][inverse])
+            layer = next(kk for kk, q in enumerate(turns) if q)
+            layers.append(layer)
+            sign = turns[layer]
+        conjugates.append((newAxis, tuple(layers), sign))
+    return tuple(conjugates)
+
+
+@lru_cache(maxsize=None)
+def standardMoves(n):
+    """
+    :return: a dict (axis, turns) -> move in standard notation, for a cube of size n (see optimizeMoves)
+    """
+    cube = templateCube(n)
+    moves = {}
+    for letter in 'FBUDLRMESfbudlr':
+        for suffix in ('', "'", '2'):
+            try:
+                move = Move(cube, letter + suffix)
+                decoded = decodeMove(n, move.face, move.span.beg, move.span.end, move.direction.id, move.times)
+            except (ValueError, IndexError):
+                continue
+            if decoded is not None and decoded not in moves:
+                moves[decoded] = letter + suffix
+    return moves
+
+
+def renderTurns(n, axis, turns):
+    """
+    Converts turns of layers around an axis into moves, using the standard notation whenever it's possible
+    :return: a list of strings with the moves
+    """
+    standard = standardMoves(n)
+    if (axis, turns) in standard:
+        return [standard[(axis, turns)]]
+    face, direction = AXES[axis]
+    moves = []
+    k = 0
+    while k < n:
+        q, beg = turns[k], k
+        while k < n and turns[k] == q:
+            k = k + 1
+        if q == 0:
+            continue
+        run = tuple(q if beg <= kk < k else 0 for kk in range(n))
+        if (axis, run) in standard:
+            moves.append(standard[(axis, run)])
+        else:
+            span = f'{beg + 1}' if k - 1 == beg else f'{beg + 1}:{k}'
+            times, d = (2, direction) if q == 2 else (1, direction if q == 1 else Dir(direction).invert().id)
+            moves.append(f'{face}.{span}.{times if times != 1 else ""}{d}')
+    return moves
+
+
+def optimizeMoves(n, sMoves, ijk=None):
+    """
+    Optimizes a string of moves for a cube of size n, leaving the cube exactly in the same state:
+        - every move is described as quarter turns of the layers around an axis (see decodePerm)
+        - the whole cube rotations are moved to the end, relabelling the moves that follow them (see rotationConjugates)
+          and are written as the shortest combination of X, Y, Z
+        - consecutive moves around the same axis commute, so they are merged adding their turns, that cancels inverse
+          moves (R R'), merges repeated ones (U U = U2) and moves of parallel layers (R L R' = L), unless the merged
+          turns need more moves than the separate ones
+        - the result is written in standard notation when possible, if not as <face>.<span>.[<times>]<direction>
+    :param n: the size of the cube
+    :param sMoves: string containing one or more moves separated by spaces (see Cube.parseMoves)
+    :param ijk: values of the variables i, j, k to use in the moves (None if they aren't used)
+    :return: the string with the optimized moves, or sMoves itself if the optimized moves are more than the original ones
+    """
+    cube = templateCube(n)
+    templateVars(n, ijk)
+    rotation = np.arange(6 * n * n)  # rotation moved to the end: sMoves = moves in the stack, then rotation
+    stack = []  # (axis, turns, pieces): the turns of the layers around the axis, rendered as the sum of the pieces
+    count = 0
+    for move in cube.parseMoves(sMoves):
+        count = count + 1
+        decoded = decodeMove(n, move.face, move.span.beg, move.span.end, move.direction.id, move.times)
+        if decoded is None:
+            continue
+        axis, layers, sign = rotationConjugates(n, rotation.tobytes())[decoded[0]]
+        turns = [0] * n
+        for k, q in enumerate(decoded[1]):
+            turns[layers[k]] = (q * sign) % 4
+        turns, pieces = tuple(turns), None
+        if stack and stack[-1][0] == axis:
+            _, lastTurns, lastPieces = stack.pop()
+            merged = tuple((q + qq) % 4 for q, qq in zip(lastTurns, turns))
+            if len(set(turns)) > 1 and len(set(merged)) > 1 and (
+                    len(renderTurns(n, axis, merged)) >
+                    sum(len(renderTurns(n, axis, p)) for p in lastPieces) + len(renderTurns(n, axis, turns))):
+                pieces = lastPieces + (turns,)  # the merged turns need more moves than keeping them apart
+            turns = merged
+        if len(set(turns)) == 1:  # all the layers turn the same, it's a whole cube rotation (or nothing)
+            rotation = turnsPerm(n, axis, turns)[rotation]
+        else:
+            stack.append((axis, turns, pieces or (turns,)))
+    moves = [m for axis, turns, pieces in stack for p in pieces for m in renderTurns(n, axis, p)]
+    moves.append(cubeRotations(n)[rotation.tobytes()][1])
+    moves = ' '.join(moves).strip()
+    return moves if len(moves.split()) <= count else sMoves.strip()
@@ -0,0 +1,241 @@
+"""
+Headless solver: runs the solving methods without the graphic interface (no PyQt5 nor VTK needed)
+
+usage:
+    python -m cubesolver solve [-m methods.json] [-t Standard] [-s SEED] [--solution] [--optimize] [--profile PREFIX]
+                               [scrambles]
+    python -m cubesolver batch [-m methods.json] [-t Standard] [-s SEED] [-j JOBS] [--details] -n COUNT SIZE [SIZE ...]
+
+Each line of the scrambles file (or stdin if no file is given) holds the size of the cube followed by the moves
+of the scramble, ie: "3 F R' U2 L". If only the size is given the cube is shuffled with random moves. Empty lines
+and lines starting with '#' are ignored. For each scramble a JSON line is written to stdout with the results.
+With --optimize the moves of the solution are optimized (see cubeBasics.optimizeMoves) before counting them.
+With --profile the statistics of every method (see methods.Perfil) are accumulated over all the scrambles and written
+to PREFIX.json and, as collapsed stacks for a flame graph, to PREFIX.folded.
+
+The batch command solves COUNT random scrambles of each SIZE in a pool of processes and writes a JSON line with
+the aggregated statistics. Each scramble is drawn from its own seed (SEED, size, number of scramble), so the
+results don't depend on the number of processes.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cubeBasics import Cube
+from util import firstAndRest
+import methods as met
+
+
+def parseScramble(line):
+    """
+    Parses a line of a scrambles file
+    :param line: string "<size> [moves]"
+    :return: tuple (size, moves) or None if the line is empty or a comment
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    size, moves = firstAndRest(line)
+    return int(size), moves
+
+
+def solve(metodos, topMethod, size, scramble='', solution=False, rng=None, perfil=None, optimize=False):
+    """
+    Solves a single scramble with a top level method
+    :param metodos: Metodos object with the solving methods
+    :param topMethod: id of the method to run (ie 'Standard')
+    :param size: size of the cube
+    :param scramble: moves to scramble the cube, if empty the cube is shuffled with random moves
+    :param solution: True to include the moves of the solution in the result
+    :param rng: np.random.RandomState for the random shuffle (see Cube.shuffle)
+    :param perfil: (optional) methods.Perfil object to accumulate the statistics of the methods
+    :param optimize: True to optimize the moves of the solution (the raw count is kept in 'rawMoves')
+    :return: a dict with the results of the solve
+    """
+    cube = Cube(size, compact=True, ids=False)
+    if scramble:
+        cube.makeMoves(scramble)
+    else:
+        scramble = cube.shuffle(rng=rng)
+    scrambleHash = f'{cube.stateHash():016x}'  # identifies the scrambled state, whatever moves led to it
+    metodos.vars.clear()  # every scramble starts with no user variables, as in a fresh session
+    soluc = []
+    t = time.perf_counter()
+    hizo, success = met.ejecutarMetodo(cube, metodos.metodo(topMethod), soluc, perfil=perfil)
+    t = time.perf_counter() - t
+    result = {
+        'size': size,
+        'scramble': scramble,
+        'scrambleHash': scrambleHash,
+        'success': bool(success),
+        'solved': cube.isSolved(),
+        'moves': met.cantMovim(soluc),
+        'time': round(t, 4),
+    }
+    if optimize:
+        result['rawMoves'] = result['moves']
+        optimized = met.optimizarSolucion(size, soluc)
+        result['moves'] = len(optimized.split())
+    if solution:
+        result['solution'] = optimized if optimize else ' '.join(s.texto for s in soluc if s.tipo in ('Pos', 'Alg'))
+    return result
+
+
+def cmdSolve(args):
+    metodos = met.Metodos(args.methods)
+    if not metodos.exist(args.top):
+        print(f'cubesolver: method {args.top!r} not found in {args.methods}', file=sys.stderr)
+        return 2
+    if args.seed is not None:
+        np.random.seed(args.seed)
+    perfil = met.Perfil() if args.profile else None
+    allSolved = True
+    for lineNo, line in enumerate(args.scrambles, start=1):
+        try:
+            parsed = parseScramble(line)
+            if parsed is None:
+                continue
+            result = {'line': lineNo}
+            result.update(solve(metodos, args.top, *parsed, solution=args.solution, perfil=perfil,
+                                optimize=args.optimize))
+        except Exception as e:  # a bad scramble shouldn't stop the whole batch
+            result = {'line': lineNo, 'error': f'{type(e).__name__}: {e}'}
+        allSolved = allSolved and result.get('solved', False)
+        print(json.dumps(result), flush=True)
+    if perfil is not None:
+        with open(args.profile + '.json', 'w') as outfile:
+            json.dump(perfil.aDict(), outfile, indent=4)
+        with open(args.profile + '.folded', 'w') as outfile:
+            outfile.write(perfil.pilasColapsadas())
+    return 0 if allSolved else 1
+
+
+_worker = {}  # the methods loaded in each process of the pool
+
+
+def initWorker(methodsFile, topMethod):
+    """
+    Loads the methods once per process of the pool
+    """
+    _worker['metodos'] = met.Metodos(methodsFile)
+    _worker['top'] = topMethod
+
+
+def solveTask(task):
+    """
+    Solves a random scramble in a process of the pool (see initWorker)
+    :param task: tuple (seed, size, index), the scramble is drawn from a RandomState seeded with the three of them
+    :return: a dict with the results of the solve (see solve)
+    """
+    seed, size, index = task
+    result = {'index': index}
+    try:
+        rng = np.random.RandomState([seed, size, index])
+        result.update(solve(_worker['metodos'], _worker['top'], size, rng=rng))
+    except Exception as e:
+        result.update({'size': size, 'error': f'{type(e).__name__}: {e}'})
+    return result
+
+
+def summarize(results):
+    """
+    Aggregates the results of a batch of solves
+    :param results: list of dicts returned by solve/solveTask, all of them for the same cube size
+    :return: a dict with the statistics of the batch and the list of the failed scrambles
+    """
+    ok = [r for r in results if r.get('solved', False)]
+    failures = [r for r in results if not r.get('solved', False)]
+    summary = {'count': len(results), 'solved': len(ok), 'failed': len(failures)}
+    hashes = [r['scrambleHash'] for r in results if 'scrambleHash' in r]
+    summary['duplicates'] = len(hashes) - len(set(hashes))  # scrambles that led to an already seen state
+    for field in ('moves', 'time'):
+        values = np.array([r[field] for r in ok], dtype=float)
+        if len(values) == 0:
+            continue
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        summary[field] = {
+            'mean': round(float(values.mean()), 4), 'p50': round(float(p50), 4), 'p90': round(float(p90), 4),
+            'p99': round(float(p99), 4), 'max': round(float(values.max()), 4), 'total': round(float(values.sum()), 4),
+        }
+    summary['failures'] = [
+        {key: r[key] for key in ('index', 'scramble', 'error', 'success') if key in r} for r in failures
+    ]
+    return summary
+
+
+def cmdBatch(args):
+    if not met.Metodos(args.methods).exist(args.top):
+        print(f'cubesolver: method {args.top!r} not found in {args.methods}', file=sys.stderr)
+        return 2
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % (2 ** 32))
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    allSolved = True
+    pool = None
+    if jobs == 1:
+        initWorker(args.methods, args.top)
+    else:
+        pool = ProcessPoolExecutor(jobs, initializer=initWorker, initargs=(args.methods, args.top))
+    try:
+        for size in args.sizes:
+            tasks = [(seed, size, index) for index in range(args.count)]
+            t = time.perf_counter()
+            if pool is None:
+                results = [solveTask(task) for task in tasks]
+            else:
+                results = list(pool.map(solveTask, tasks, chunksize=max(1, len(tasks) // (jobs * 8))))
+            wall = time.perf_counter() - t
+            if args.details:
+                for result in results:
+                    print(json.dumps(result), flush=True)
+            summary = {'size': size, 'seed': seed, 'jobs': jobs, 'wall': round(wall, 4)}
+            summary.update(summarize(results))
+            allSolved = allSolved and summary['failed'] == 0
+            print(json.dumps(summary), flush=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return 0 if allSolved else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='cubesolver', description="Headless Rubik's cube solver")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_solve = commands.add_parser('solve', help='solve the scrambles and write the results as JSON lines')
+    parser_solve.add_argument('scrambles', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                              help='file with one "<size> [moves]" scramble per line (default: stdin)')
+    parser_solve.add_argument('-m', '--methods', default='methods.json',
+                              help='JSON file with the solving methods (default: methods.json)')
+    parser_solve.add_argument('-t', '--top', default='Standard', help='method to run (default: Standard)')
+    parser_solve.add_argument('-s', '--seed', type=int, default=None, help='seed for the random scrambles')
+    parser_solve.add_argument('--solution', action='store_true', help='include the moves of the solution')
+    parser_solve.add_argument('--optimize', action='store_true',
+                              help='optimize the moves of the solution (cancel, merge, fold rotations)')
+    parser_solve.add_argument('--profile', metavar='PREFIX',
+                              help='write the statistics of the methods to PREFIX.json and PREFIX.folded')
+    parser_solve.set_defaults(func=cmdSolve)
+
+    parser_batch = commands.add_parser('batch', help='solve random scrambles in parallel and write the statistics')
+    parser_batch.add_argument('sizes', nargs='+', type=int, help='sizes of the cubes to solve')
+    parser_batch.add_argument('-n', '--count', type=int, required=True, help='number of scrambles of each size')
+    parser_batch.add_argument('-m', '--methods', default='methods.json',
+                              help='JSON file with the solving methods (default: methods.json)')
+    parser_batch.add_argument('-t', '--top', default='Standard', help='method to run (default: Standard)')
+    parser_batch.add_argument('-s', '--seed', type=int, default=None, help='seed for the scrambles (default: random)')
+    parser_batch.add_argument('-j', '--jobs', type=int, default=0,
+                              help='number of processes (default: one per cpu)')
+    parser_batch.add_argument('--details', action='store_true', help='write also the result of every scramble')
+    parser_batch.set_defaults(func=cmdBatch)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
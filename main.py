@@ -15,6 +15,7 @@ import vtk
 from vtk import vtkPolyDataMapper, vtkNamedColors
 from vtk import vtkRenderer, vtkActor, vtkRegularPolygonSource, vtkCubeSource
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+from vtk.util.numpy_support import numpy_to_vtk
 
 # Qt GUI
 from PyQt5 import Qt
@@ -30,14 +31,22 @@ from gallery import Gallery
 
 colores = {"F": "red", "B": "orange", "U": "white", "D": "yellow", "L": "green", "R": "blue"}
 
+# colores de vtk de los colores del cubo, se buscan una sola vez
+RGB = {color: tuple(vtkNamedColors().GetColor3d(color)) for color in Face.COLORS}  # nombre: (r, g, b) entre 0 y 1
+RGB_CODIGOS = np.array([vtkNamedColors().GetColor3ub(color) for color in Face.COLORS], dtype=np.uint8)  # por codigo
+
 
 class CubeVtk(Cube):
+    GLIFOS_DESDE = 10  # tamaño de cubo a partir del cual se dibuja con glifos (ver inicGlifos)
 
-    def __init__(self, renderer, size=3, white=False):
+    def __init__(self, renderer, size=3, white=False, glifos=None):
+        # glifos: True para dibujar todas las celdas con glifos en lugar de un actor por celda (ver inicGlifos), False
+        #         para usar siempre un actor por celda, None para decidirlo segun el tamaño del cubo (GLIFOS_DESDE)
 
         super().__init__(size, white)
 
         self.renderer = renderer
+        self.modoGlifos = glifos
         # atributos que definen la estetica de representacion en pantalla
         self.gap = 0
         self.innerColor = Qt.QColor('black')
@@ -94,73 +103,222 @@ class CubeVtk(Cube):
         self.FCCube["R"] = np.array([dsp, dsp, dsp])
         self.angulo["R"] = (45.0, 90.0, 0.0)  # plano YZ
 
-    def inicActores(self):  # crea e inicializa un actor y un assembly por cada celda del cubo
-        # Crear el source para un cuadrado
-        cuad = vtkRegularPolygonSource()
-        cuad.SetNumberOfSides(4)
-        cuad.SetRadius(1.0)
-        # Cear el source de los cubitos
-        cube = vtkCubeSource()
-        cube.SetXLength(1.0)
-        cube.SetYLength(1.0)
-        cube.SetZLength(1.0)
-        # Crear el mapper del cuadrado y los cubos y conectarlos con su source
-        mappCuad = vtkPolyDataMapper()
-        mappCuad.SetInputConnection(cuad.GetOutputPort())
-        mappCube = vtkPolyDataMapper()
-        mappCube.SetInputConnection(cube.GetOutputPort())
+        # ubicacion de todas las celdas de una sola vez, arrays (6, n, n, 3) indexados por [Face.INDEX[face], r, c]
+        #   - posCeldas: posicion de cada calcomania, [r, c, 1] . FC2xyz
+        #   - posCubitos: posicion de cada cubito, [r, c, 0] . 0.98 FC2xyz + FCCube
+        #   - despOtros: vector en que se desplazan los otros actores de la celda, el centro de su cara (es tambien el
+        #                eje de los giros de la cara, ver Anim)
+        mid = (self.n - 1) / 2
+        coef = np.stack([self.FC2xyz[face] for face in Face.FACES])[:, None, None]  # (6, 1, 1, 3, 3)
+        filas, columnas = np.indices((self.n, self.n))[..., None]
+        self.posCeldas = filas * coef[..., 0, :] + columnas * coef[..., 1, :] + coef[..., 2, :]
+        self.posCubitos = 0.98 * (filas * coef[..., 0, :] + columnas * coef[..., 1, :]) + \
+            np.stack([self.FCCube[face] for face in Face.FACES])[:, None, None]
+        self.despOtros = np.broadcast_to(mid * coef[..., 0, :] + mid * coef[..., 1, :] + coef[..., 2, :],
+                                         self.posCeldas.shape)
+        # las mismas ubicaciones como listas en el orden del estado del cubo (ver Cube.index), para refreshCelda
+        self.ubicacion = list(zip(*(array.reshape(-1, 3).tolist()
+                                    for array in (self.posCeldas, self.posCubitos, self.despOtros))))
+
+    def inicActores(self):  # crea e inicializa un actor y un assembly por cada celda del cubo (o los glifos)
         self.inicCoefUbicacion()
-        for face in Face.FACES:
-            for r in range(self.n):
-                for c in range(self.n):
-                    self.faces[face][r, c].actor = vtkActor()
-                    self.faces[face][r, c].actor.SetMapper(mappCuad)
-                    self.faces[face][r, c].interior = vtkActor()
-                    self.faces[face][r, c].interior.SetMapper(mappCube)
-                    self.faces[face][r, c].ass = vtk.vtkAssembly()
-                    self.faces[face][r, c].ass.AddPart(self.faces[face][r, c].actor)
-                    self.faces[face][r, c].ass.AddPart(self.faces[face][r, c].interior)
-                    self.faces[face][
-                        r, c].otros = []  # lista de otros actores que quiera que se muevan junto con esta celda
-                    self.renderer.AddActor(self.faces[face][r, c].ass)
+        self.glifos = self.n >= self.GLIFOS_DESDE if self.modoGlifos is None else self.modoGlifos
+        if self.glifos:
+            self.inicGlifos()
+        else:
+            # Crear el source para un cuadrado
+            cuad = vtkRegularPolygonSource()
+            cuad.SetNumberOfSides(4)
+            cuad.SetRadius(1.0)
+            # Cear el source de los cubitos
+            cube = vtkCubeSource()
+            cube.SetXLength(1.0)
+            cube.SetYLength(1.0)
+            cube.SetZLength(1.0)
+            # Crear el mapper del cuadrado y los cubos y conectarlos con su source
+            mappCuad = vtkPolyDataMapper()
+            mappCuad.SetInputConnection(cuad.GetOutputPort())
+            mappCube = vtkPolyDataMapper()
+            mappCube.SetInputConnection(cube.GetOutputPort())
+            for face in Face.FACES:
+                for r in range(self.n):
+                    for c in range(self.n):
+                        self.faces[face][r, c].actor = vtkActor()
+                        self.faces[face][r, c].actor.SetMapper(mappCuad)
+                        self.faces[face][r, c].interior = vtkActor()
+                        self.faces[face][r, c].interior.SetMapper(mappCube)
+                        self.faces[face][r, c].ass = vtk.vtkAssembly()
+                        self.faces[face][r, c].ass.AddPart(self.faces[face][r, c].actor)
+                        self.faces[face][r, c].ass.AddPart(self.faces[face][r, c].interior)
+                        self.faces[face][
+                            r, c].otros = []  # lista de otros actores que quiera que se muevan junto con esta celda
+                        self.renderer.AddActor(self.faces[face][r, c].ass)
 
         self.refreshStyleCeldas()
         self.refreshActores()
 
-    def refreshActores(
-            self):  # refresca la posicion de las celdas para que coincidan con la cara,fila,columna donde estan ubicadas
-        mid = (self.n - 1) / 2
-        for face, r, c in [(face, r, c) for face in Face.FACES for r in range(self.n) for c in range(self.n)]:
-            self.faces[face][r, c].actor.GetProperty().SetColor(vtkNamedColors().GetColor3d(self.faces[face][r, c].color))
-            self.faces[face][r, c].actor.SetOrientation(self.angulo[face])
-            self.faces[face][r, c].actor.SetPosition(np.dot([r, c, 1], self.FC2xyz[face]))
-            self.faces[face][r, c].interior.SetPosition(
-                np.dot([r, c, 0], 0.98 * self.FC2xyz[face]) + self.FCCube[face])
-            for i in range(len(self.faces[face][r, c].otros) // 2):
-                (desp, act) = self.faces[face][r, c].otros[2 * i]  # symbol
-                act.SetOrientation(self.angulo[face])
-                pos = np.dot([r, c, 1], self.FC2xyz[face])  # posicion de esa celda
-                pos = pos + np.dot([mid, mid, 1], self.FC2xyz[face]) * (i + 1) * desp  # + desplazamiento
-                act.SetPosition(pos)
-                (despT, act) = self.faces[face][r, c].otros[2 * i + 1]  # text
-                act.SetOrientation(self.angulo[face])
-                pos = np.dot([r, c, 1], self.FC2xyz[face])  # posicion de esa celda
-                pos = pos + np.dot([mid, mid, 1], self.FC2xyz[face]) * (
-                        (i + 1) * desp + despT)  # + desplazamiento
-                act.SetPosition(pos)
-            self.faces[face][r, c].ass.SetOrientation(0, 0, 0)
-        self.renderer.GetRenderWindow().Render()
+    def inicGlifos(self):
+        # Dibuja todas las calcomanias con un solo vtkGlyph3DMapper (y todos los cubitos interiores con otro): un punto
+        # por celda, en el orden del estado del cubo, con su color y su orientacion (cuaternion) como datos del punto.
+        # Los colores salen directamente del array de colores del cubo (ver refreshActores) y la animacion gira los
+        # puntos de las celdas que se mueven (ver rotarCeldas). Las celdas solo tienen un assembly propio si se les
+        # agregan otros actores (ver agregarOtro)
+        n = self.n
+        caras = np.repeat(np.arange(6), n * n)
+        orientacion = vtkActor()
+        cuaterniones = []
+        for face in Face.FACES:
+            orientacion.SetOrientation(self.angulo[face])
+            grados, x, y, z = orientacion.GetOrientationWXYZ()
+            eje = np.array([x, y, z]) / (np.linalg.norm([x, y, z]) or 1)
+            cuaterniones.append(np.concatenate([[np.cos(np.radians(grados) / 2)], eje * np.sin(np.radians(grados) / 2)]))
+        cuatCeldas = np.stack(cuaterniones)[caras]
+        cuatInteriores = np.tile([1.0, 0.0, 0.0, 0.0], (6 * n * n, 1))  # los cubitos no se rotan
+        self.giros = np.zeros(6 * n * n)  # grados que se giro cada celda en la animacion en curso
+        self.glifoCuad = vtkRegularPolygonSource()
+        self.glifoCuad.SetNumberOfSides(4)
+        self.glifoCube = vtkCubeSource()
+        # por cada capa de glifos: (actor, posiciones y cuaterniones sin girar, posiciones y cuaterniones dibujados)
+        self.capasGlifos = [self.capaGlifos(self.glifoCuad, self.posCeldas.reshape(-1, 3), cuatCeldas),
+                            self.capaGlifos(self.glifoCube, self.posCubitos.reshape(-1, 3), cuatInteriores)]
+        self.actorCeldas, self.actorInteriores = [capa[0] for capa in self.capasGlifos]
+        self.coloresCeldas = np.zeros((6 * n * n, 3), dtype=np.uint8)  # el vtk array comparte la memoria
+        colores = numpy_to_vtk(self.coloresCeldas)
+        colores.SetName('colores')
+        self.actorCeldas.GetMapper().GetInput().GetPointData().SetScalars(colores)
+        for tile in self.tiles:
+            tile.ass = None
+            tile.otros = []
+
+    def capaGlifos(self, source, posiciones, cuaterniones):  # crea un actor que dibuja source en cada posicion
+        dibujadas = (posiciones.copy(), cuaterniones.copy())  # los vtk arrays comparten la memoria de estos
+        puntos = vtk.vtkPoints()
+        puntos.SetData(numpy_to_vtk(dibujadas[0]))
+        poly = vtk.vtkPolyData()
+        poly.SetPoints(puntos)
+        orientaciones = numpy_to_vtk(dibujadas[1])
+        orientaciones.SetName('orientacion')
+        poly.GetPointData().AddArray(orientaciones)
+        mapper = vtk.vtkGlyph3DMapper()
+        mapper.SetInputData(poly)
+        mapper.SetSourceConnection(source.GetOutputPort())
+        mapper.SetOrientationArray('orientacion')
+        mapper.SetOrientationModeToQuaternion()
+        mapper.ScalingOff()
+        mapper.SetColorModeToDirectScalars()
+        actor = vtkActor()
+        actor.SetMapper(mapper)
+        self.renderer.AddActor(actor)
+        return (actor, posiciones, cuaterniones) + dibujadas
+
+    def glifosModificados(self):  # avisa a vtk que cambiaron los arrays de los glifos
+        for (actor, _, _, _, _) in self.capasGlifos:
+            poly = actor.GetMapper().GetInput()
+            poly.GetPoints().Modified()
+            poly.GetPointData().GetArray('orientacion').Modified()
+            poly.Modified()
+        self.actorCeldas.GetMapper().GetInput().GetPointData().GetScalars().Modified()
+
+    def rotarCeldas(self, celdas, grados, vector):
+        # gira los actores de las celdas (TAddress) alrededor del vector que pasa por el centro del cubo, una vez por
+        # cada aparicion de la celda en la lista (en un giro multiple las celdas se repiten)
+        for ta in celdas:
+            ass = self.faces[ta.f][ta.r, ta.c].ass
+            if ass is not None:
+                ass.RotateWXYZ(grados, vector[0], vector[1], vector[2])
+        if not self.glifos or len(celdas) == 0:
+            return
+        indices = np.array([self.index(ta.f, ta.r, ta.c) for ta in celdas])
+        np.add.at(self.giros, indices, grados)
+        indices = np.unique(indices)
+        eje = np.asarray(vector, dtype=float) / np.linalg.norm(vector)
+        angulos = np.radians(self.giros[indices])[:, None]
+        giro = np.concatenate([np.cos(angulos / 2), eje * np.sin(angulos / 2)], axis=1)  # cuaternion del giro
+        for (_, posiciones, cuaterniones, dibujadas, cuatDibujados) in self.capasGlifos:
+            pos = posiciones[indices]  # formula de Rodrigues
+            dibujadas[indices] = pos * np.cos(angulos) + np.cross(eje, pos) * np.sin(angulos) + \
+                np.outer(pos @ eje, eje) * (1 - np.cos(angulos))
+            cuatDibujados[indices] = productoCuaterniones(giro, cuaterniones[indices])
+        self.glifosModificados()
+
+    def refreshActores(self, celdas=None, dibujar=True):
+        # refresca la posicion de las celdas para que coincidan con la cara,fila,columna donde estan ubicadas
+        # celdas: (opcional) lista de las celdas cambiadas (TAddress, como las devuelve oneMove en changedTiles), si se
+        #         indica solo se refrescan esas, si no todas las del cubo
+        # dibujar: False para no redibujar la ventana (si se va a dibujar despues)
+        if celdas is None:
+            celdas = [(face, r, c) for face in Face.FACES for r in range(self.n) for c in range(self.n)]
+        else:
+            celdas = {(ta.f, ta.r, ta.c) for ta in celdas}  # en un giro multiple las celdas se repiten
+        if self.glifos:  # los arrays de los glifos se actualizan enteros, solo se recorren las celdas con otros actores
+            self.refreshGlifos()
+            celdas = [(face, r, c) for (face, r, c) in celdas if self.faces[face][r, c].ass is not None]
+        for face, r, c in celdas:
+            self.refreshCelda(face, r, c)
+        if dibujar:
+            self.renderer.GetRenderWindow().Render()
+
+    def refreshGlifos(self):  # pone los glifos en su lugar, sin girar, con los colores actuales del cubo
+        self.coloresCeldas[:] = RGB_CODIGOS[self.colors]
+        self.giros[:] = 0
+        for (_, posiciones, cuaterniones, dibujadas, cuatDibujados) in self.capasGlifos:
+            dibujadas[:] = posiciones
+            cuatDibujados[:] = cuaterniones
+        self.glifosModificados()
+
+    def refreshCelda(self, face, r, c):  # ubica y colorea los actores de una celda (ver refreshActores)
+        celda = self.faces[face][r, c]
+        posCelda, posCubito, vectorOtros = self.ubicacion[self.index(face, r, c)]
+        if not self.glifos:
+            celda.actor.GetProperty().SetColor(RGB[celda.color])
+            celda.actor.SetOrientation(self.angulo[face])
+            celda.actor.SetPosition(posCelda)
+            celda.interior.SetPosition(posCubito)
+        for i in range(len(celda.otros) // 2):
+            (desp, act) = celda.otros[2 * i]  # symbol
+            act.SetOrientation(self.angulo[face])
+            act.SetPosition(np.add(posCelda, np.multiply(vectorOtros, (i + 1) * desp)))  # posicion + desplazamiento
+            (despT, act) = celda.otros[2 * i + 1]  # text
+            act.SetOrientation(self.angulo[face])
+            act.SetPosition(np.add(posCelda, np.multiply(vectorOtros, (i + 1) * desp + despT)))
+        celda.ass.SetOrientation(0, 0, 0)
 
     def refreshStyleCeldas(self):  # refresca el estilo del cubo (color del interior y gap de las "calcomanias")
         escInt = 0.98
         escala = np.cos(np.pi / 4) * (1 - self.gap)
-        for face in Face.FACES:
-            for r in range(self.n):
-                for c in range(self.n):
-                    self.faces[face][r, c].actor.SetScale(escala, escala, escala)
-                    self.faces[face][r, c].interior.SetScale(escInt, escInt, escInt)
-                    self.faces[face][r, c].interior.GetProperty().SetColor(qColor2RGB(self.innerColor))
-                    self.faces[face][r, c].interior.GetProperty().SetOpacity(self.innerColor.alphaF())
+        if self.glifos:  # la escala se aplica a la geometria de los glifos
+            self.glifoCuad.SetRadius(escala)
+            self.glifoCube.SetXLength(escInt)
+            self.glifoCube.SetYLength(escInt)
+            self.glifoCube.SetZLength(escInt)
+            self.actorInteriores.GetProperty().SetColor(qColor2RGB(self.innerColor))
+            self.actorInteriores.GetProperty().SetOpacity(self.innerColor.alphaF())
+        else:
+            for face in Face.FACES:
+                for r in range(self.n):
+                    for c in range(self.n):
+                        self.faces[face][r, c].actor.SetScale(escala, escala, escala)
+                        self.faces[face][r, c].interior.SetScale(escInt, escInt, escInt)
+                        self.faces[face][r, c].interior.GetProperty().SetColor(qColor2RGB(self.innerColor))
+                        self.faces[face][r, c].interior.GetProperty().SetOpacity(self.innerColor.alphaF())
+        self.renderer.GetRenderWindow().Render()
+
+    def agregarOtro(self, face, r, c, desp, act):  # agrega un actor que se mueve junto con la celda (ver refreshCelda)
+        celda = self.faces[face][r, c]
+        if celda.ass is None:  # con glifos la celda no tiene assembly hasta que se le agrega un actor
+            celda.ass = vtk.vtkAssembly()
+            self.renderer.AddActor(celda.ass)
+        celda.ass.AddPart(act)
+        celda.otros.append((desp, act))
+
+    def quitarOtros(self):  # quita los actores agregados a las celdas con agregarOtro
+        for tile in self.tiles:
+            for (_, act) in tile.otros:
+                tile.ass.RemovePart(act)
+            tile.otros = []
+            if self.glifos and tile.ass is not None:
+                self.renderer.RemoveActor(tile.ass)
+                tile.ass = None
         self.renderer.GetRenderWindow().Render()
 
     def resetCamara(self):
@@ -171,10 +329,20 @@ class CubeVtk(Cube):
         self.renderer.GetActiveCamera().OrthogonalizeViewUp()
         self.renderer.GetActiveCamera().Azimuth(self.camPosition[0])
         self.renderer.GetActiveCamera().Elevation(self.camPosition[1])
-        self.renderer.ResetCamera()
+        if self.glifos:  # vtk calcula los limites de los glifos con holgura, uso los que tendrian los actores
+            lim = max(self.n / 2, self.n / 2 + 0.5 - self.gap)
+            self.renderer.ResetCamera(-lim, lim, -lim, lim, -lim, lim)
+        else:
+            self.renderer.ResetCamera()
         self.renderer.GetActiveCamera().Zoom(self.camPosition[2])
         self.renderer.GetRenderWindow().Render()
 
+    def restore(self, snapshot, dibujar=True):  # vuelve a un estado guardado recoloreando los actores existentes
+        # dibujar: False para no refrescar los actores (si se van a refrescar despues con refreshActores)
+        super().restore(snapshot)
+        if dibujar:
+            self.refreshActores()
+
     def cambioTamanio(self, newTamanio):
         if self.n != newTamanio:
             super().__init__(newTamanio, self.white)
@@ -204,69 +372,121 @@ def qColor2RGB(qc):
     return (qc.redF(), qc.greenF(), qc.blueF())
 
 
+def productoCuaterniones(q1, q2):  # producto fila por fila de dos arrays de cuaterniones (w, x, y, z)
+    w1, v1 = q1[:, :1], q1[:, 1:]
+    w2, v2 = q2[:, :1], q2[:, 1:]
+    return np.concatenate([w1 * w2 - (v1 * v2).sum(axis=1, keepdims=True), w1 * v2 + w2 * v1 + np.cross(v1, v2)],
+                          axis=1)
+
+
 class MainWindow(Qt.QMainWindow):
     class Anim:
+        COLA_ACELERAR = 10  # con mas movimientos en la cola se acelera en proporcion (ver gradosCuadro)
+        MAX_PASO = 0.25  # segundos maximos entre cuadros que se tienen en cuenta (por si se trabo la aplicacion)
+
         def __init__(self, parent, cuboAnim, frameRate):
             self.parent = parent
             self.cuboAnim = cuboAnim
             self.frameRate = frameRate
             self.waterMark = 0  # para calcular el grado de avance
-            self.inc = 0
+            self.inc = 0  # grados a girar en cada cuadro, a la frecuencia frameRate (la velocidad se mide en tiempo)
             self.mostrarMovim = True
             self.jobs = deque()
+            self.refrescoCompleto = False  # hubo movimientos sin animar, hay que refrescar todas las celdas
+            self.ultimoCuadro = None  # momento del ultimo cuadro, None si la animacion estaba detenida
+            self.cuadros = 0  # cuadros dibujados desde inicioFps
+            self.inicioFps = None
 
         class Job:
             def __init__(self, movim):
                 self.movim = movim
-                self.listaActores = []
+                self.celdas = []  # celdas cambiadas por el movimiento, las unicas que hay que refrescar al terminar
                 self.rotar = 0
                 self.vector = []
                 self.avance = 0
 
+        def gradosCuadro(self, ahora):
+            # grados a girar en este cuadro segun el tiempo transcurrido desde el anterior, a la velocidad elegida
+            # (inc grados cada 1/frameRate segundos) multiplicada por la cantidad de trabajo pendiente
+            paso = 1 / self.frameRate if self.ultimoCuadro is None else min(ahora - self.ultimoCuadro, self.MAX_PASO)
+            self.ultimoCuadro = ahora
+            aceleracion = max(1.0, len(self.jobs) / self.COLA_ACELERAR)
+            return max(self.inc, 1) * self.frameRate * paso * aceleracion
+
         def callBack(self, caller, timerEvent):
             if len(self.jobs) == 0:
                 return
-
+            ahora = time.perf_counter()
             if not self.mostrarMovim:
-                if self.jobs[0].avance > 0:
-                    self.jobs.popleft()  # no hago endJob para no perder tiempo en actualizar la pantalla
-                    if len(self.jobs) == 0:  # si era el ultimo trabajo, hago endAllJobs para actualizar la imagen del cubo y la progressBar
-                        self.endAllJobs()
-                        return
-
-            # procesar el jobs[0]
-            if self.jobs[0].avance == 0:  # inicializo el job
+                self.sinAnimar(ahora)
+                return
+
+            # los movimientos que se completan dentro de este cuadro se hacen sin animar (se juntan en un solo
+            # refresco), el que queda a medio camino se gira y se dibuja
+            grados = self.gradosCuadro(ahora)
+            celdas = []  # celdas de los movimientos terminados, a refrescar antes de empezar el siguiente
+            while len(self.jobs) > 0 and grados > 0:
+                job = self.jobs[0]
+                if job.avance == 0:  # inicializo el job
+                    if 'Actualiza' in job.movim:
+                        self.parent.actualizaCurrentRowSoluc(int(job.movim.split('-')[1]))
+                        self.terminarJob()
+                        continue
+                    move = Move(self.cuboAnim, job.movim)
+                    if grados < 90:  # se va a animar: antes refresco los anteriores, la animacion parte de ahi
+                        self.refrescar(celdas)
+                        celdas = []
+                    self.cuboAnim.oneMove(move, job.celdas)
+                    caraEje = self.cuboAnim.anticlockwiseFace(move.face, move.direction.id)
+                    job.vector = self.cuboAnim.despOtros[Face.INDEX[caraEje], 0, 0]  # centro de la cara
+                    job.rotar = 90  # si el giro es multiple las celdas estan multip veces => siempre 90
+                inc = min(grados, job.rotar - job.avance)  # para no pasarse de la rotacion pedida!!
+                grados = grados - inc
+                job.avance += inc
+                if job.avance >= job.rotar:
+                    celdas.extend(job.celdas)
+                    self.terminarJob()
+                else:
+                    self.cuboAnim.rotarCeldas(job.celdas, inc, job.vector)
+            self.refrescar(celdas)
+            self.cuboAnim.renderer.GetRenderWindow().Render()
+            self.contarCuadro(ahora)
+            if len(self.jobs) == 0:  # Si este era el ultimo actualizo la progressBar (el cubo ya esta actualizado)
+                self.endAllJobs(refrescar=False)
+
+        def sinAnimar(self, ahora):
+            # hace los movimientos sin animarlos, todos los que entran en un cuadro, y refresca al terminar
+            if self.jobs[0].avance > 0:  # habia uno a medio animar, ya esta hecho
+                self.terminarJob()
+                self.refrescoCompleto = True
+            while len(self.jobs) > 0 and time.perf_counter() - ahora < 1 / self.frameRate:
                 if 'Actualiza' in self.jobs[0].movim:
                     self.parent.actualizaCurrentRowSoluc(int(self.jobs[0].movim.split('-')[1]))
-                    self.endJob()
-                    return
-                move = Move(self.cuboAnim, self.jobs[0].movim)
-                celdasMovidas = None if not self.mostrarMovim else []
-                self.cuboAnim.oneMove(move, celdasMovidas)
-                if self.mostrarMovim:
-                    self.jobs[0].listaActores = [self.cuboAnim.faces[ta.f][ta.r, ta.c].ass for ta in celdasMovidas]
-                    n = self.cuboAnim.n
-                    self.jobs[0].vector = np.dot(
-                        [(n - 1) / 2, (n - 1) / 2, 1],
-                        self.cuboAnim.FC2xyz[self.cuboAnim.anticlockwiseFace(move.face, move.direction.id)]
-                    )
-                    self.jobs[0].rotar = 90  # si el giro es multiple los actores estan multip veces => siempre 90
                 else:
-                    self.jobs.popleft()  # no hago endJob para no actualizar la pantalla en cada movimiento
-                    self.parent.animProgressBar.setValue(self.waterMark - len(self.jobs))
-                    if len(self.jobs) == 0:  # al tarminar TODOS los movimientos hago endAllobs para actualizar la imagen del cubo y la progressBar
-                        self.endAllJobs()
-                    return
-            inc = self.inc  # grados a rotar en este ciclo.
-            # TODO: calcularlo en funcion de la carga de trabajo (acelerar si hay mucho)
-            inc = 1 if int(inc) < 1 else int(inc)  # ajuste luego del calculo
-            inc = min(inc, self.jobs[0].rotar - self.jobs[0].avance)  # para no pasarse de la rotacion pedida!!
-            for act in self.jobs[0].listaActores:
-                act.RotateWXYZ(inc, self.jobs[0].vector[0], self.jobs[0].vector[1], self.jobs[0].vector[2])
-            self.cuboAnim.renderer.GetRenderWindow().Render()
-            self.jobs[0].avance += inc
-            if self.jobs[0].avance == self.jobs[0].rotar:
-                self.endJob()
+                    self.cuboAnim.oneMove(Move(self.cuboAnim, self.jobs[0].movim))
+                    self.refrescoCompleto = True
+                self.terminarJob()
+            if len(self.jobs) == 0:  # al terminar TODOS los movimientos actualizo la imagen del cubo y la progressBar
+                self.endAllJobs()
+
+        def refrescar(self, celdas):  # refresca las celdas de los movimientos terminados (o todas si hace falta)
+            if self.refrescoCompleto:
+                self.refrescoCompleto = False
+                self.cuboAnim.refreshActores(dibujar=False)
+            elif celdas:
+                self.cuboAnim.refreshActores(celdas, dibujar=False)
+
+        def terminarJob(self):
+            self.jobs.popleft()
+            self.parent.animProgressBar.setValue(self.waterMark - len(self.jobs))
+
+        def contarCuadro(self, ahora):  # cuenta los cuadros dibujados y muestra los cuadros por segundo logrados
+            if self.inicioFps is None:
+                self.inicioFps, self.cuadros = ahora, 0
+            self.cuadros += 1
+            if ahora - self.inicioFps >= 1:
+                self.parent.animFps.setText('{0:.0f} fps'.format(self.cuadros / (ahora - self.inicioFps)))
+                self.inicioFps, self.cuadros = ahora, 0
 
         def addJobs(self, movimientos):
             espejo = ''
@@ -281,19 +501,18 @@ class MainWindow(Qt.QMainWindow):
                 self.waterMark = len(self.jobs)
                 self.parent.animProgressBar.setRange(0, self.waterMark)
 
-        def endJob(self):
-            self.cuboAnim.refreshActores()
-            self.jobs.popleft()
-            self.parent.animProgressBar.setValue(self.waterMark - len(self.jobs))
-            if len(self.jobs) == 0:  # Si este era el ultimo actualizo por ultima vez el cubo y la progressBar
-                self.endAllJobs()
-
-        def endAllJobs(self):
+        def endAllJobs(self, refrescar=True):
+            # refrescar: refrescar todas las celdas, puede haber movimientos sin animar o uno a medio animar
             self.jobs.clear()
             self.waterMark = 0
+            self.ultimoCuadro = None
+            self.inicioFps = None
             self.parent.animProgressBar.setRange(0, 1)
             self.parent.animProgressBar.setValue(0)
-            self.cuboAnim.refreshActores()
+            self.parent.animFps.setText('')
+            if refrescar:
+                self.refrescoCompleto = False
+                self.cuboAnim.refreshActores()
 
     def __init__(self, parent=None):
         Qt.QMainWindow.__init__(self, parent)
@@ -486,10 +705,13 @@ class MainWindow(Qt.QMainWindow):
         self.animProgressBar.setRange(0, 10000)
         self.animProgressBar.setValue(0)
 
+        self.animFps = Qt.QLabel('')  # cuadros por segundo logrados mientras se anima (ver Anim.contarCuadro)
+
         layout = Qt.QGridLayout()
         layout.addWidget(self.showMovimCheckBox, 0, 0)
         layout.addWidget(self.animProgressBar, 1, 0)
-        layout.addWidget(self.dialAnimacion, 0, 1, 2, 1)
+        layout.addWidget(self.animFps, 2, 0)
+        layout.addWidget(self.dialAnimacion, 0, 1, 3, 1)
         self.animWidgets.setLayout(layout)
 
     def crearCuboWidgets(self):
@@ -1596,20 +1818,12 @@ class MainWindow(Qt.QMainWindow):
                 act2 = self.gallery.actorT(addOn)
             else:
                 act2 = self.gallery.actor(addOn)
-            cubo.faces[face][fila, columna].ass.AddPart(act1)
-            cubo.faces[face][fila, columna].otros.append((0.1, act1))  # ( desplazamiento, actor )
-            cubo.faces[face][fila, columna].ass.AddPart(act2)
-            cubo.faces[face][fila, columna].otros.append((0.035, act2))  # ( desplazamiento, actor )
+            cubo.agregarOtro(face, fila, columna, 0.1, act1)  # ( desplazamiento, actor )
+            cubo.agregarOtro(face, fila, columna, 0.035, act2)
         cubo.refreshActores()
 
     def clearHints(self, cubo):
-        for face in cubo.faces:
-            for r in range(cubo.n):
-                for c in range(cubo.n):
-                    for (_, act) in cubo.faces[face][r, c].otros:
-                        cubo.faces[face][r, c].ass.RemovePart(act)
-                    cubo.faces[face][r, c].otros = []
-        cubo.renderer.GetRenderWindow().Render()
+        cubo.quitarOtros()
 
     @pyqtSlot()
     def solucShowUnusedOnOff(self):
@@ -1739,13 +1953,13 @@ class MainWindow(Qt.QMainWindow):
     def mostrarEjecucion(self):
         texto = self.arbolMetodos.currentItem().text(0)
         if texto[0:6] == 'Met : ':
-            cuboAuxiliar = self.saveCubo()
+            estadoPrevio = self.cubo.snapshot()
             self.soluc = []
             t = time.time()
             met.ejecutarMetodo(self.cubo, self.metodos.metodo(texto[6:]), self.soluc)
             t = str(datetime.timedelta(seconds=round(time.time() - t, 2)))[:-4]
             self.alert('{0} movimientos, tiempo de ejecucion: {1}'.format(met.cantMovim(self.soluc), t))
-            self.loadCuboFrom(cuboAuxiliar)
+            self.cubo.restore(estadoPrevio)
             self.cargaSolucion()
             self.arbolMetodosWidgets.hide()
             self.movimWidgets.hide()
@@ -1778,7 +1992,7 @@ class MainWindow(Qt.QMainWindow):
                 while self.mezcladoPrevio.value() > 0:
                     self.cubo.shuffle()
                     self.cubo.refreshActores()
-                    cuboAuxiliar = self.saveCubo()
+                    estadoPrevio = self.cubo.snapshot()
                     self.soluc = []
                     (hizo, success) = met.ejecutarMetodo(self.cubo, self.metodos.metodo(texto[6:]), self.soluc)
                     cantMovim = cantMovim + met.cantMovim(self.soluc)
@@ -1786,7 +2000,7 @@ class MainWindow(Qt.QMainWindow):
                         self.mezcladoPrevio.setValue(self.mezcladoPrevio.value() - 1)
                         self.animProgressBar.setValue(tot - self.mezcladoPrevio.value())
                     else:
-                        self.loadCuboFrom(cuboAuxiliar)
+                        self.cubo.restore(estadoPrevio, dibujar=False)  # se refresca al salir del loop
                         self.mezcladoPrevio.setValue(0)
                 self.cubo.refreshActores()
                 if success:
@@ -1806,10 +2020,10 @@ class MainWindow(Qt.QMainWindow):
             self.animProgressBar.setValue(0)
         else:
             if texto[0:6] == 'Met : ':
-                cuboAuxiliar = self.saveCubo()
+                estadoPrevio = self.cubo.snapshot()
                 self.soluc = []
                 met.ejecutarMetodo(self.cubo, self.metodos.metodo(texto[6:]), self.soluc)
-                self.loadCuboFrom(cuboAuxiliar)
+                self.cubo.restore(estadoPrevio)
                 for s in self.soluc:
                     if s.tipo in 'Pos/Alg':
                         self.anim.addJobs(s.texto)  # el movimiento lo hace anim.callBack cuando sea oportuno
@@ -1824,42 +2038,10 @@ class MainWindow(Qt.QMainWindow):
         self.anim.addJobs(movim)  # el movimiento lo hace anim.callBack cuando sea oportuno
         self.movimientos.setText("")
 
-    class Preset:
-        def __init__(self, faces=None, n=None, conn=None, colorRel=None):
-            self.faces = faces
-            self.n = n
-            self.conn = conn
-            self.colorRel = colorRel
-
-    def saveCubo(self):
-        # guardo solo algunos campos pues los objetos de vtk no son "deep copiables"
-        cub = Cube(self.cubo.n)
-        for face in cub.faces:
-            for fila in range(cub.n):
-                for columna in range(cub.n):
-                    cub.faces[face][fila, columna].id = self.cubo.faces[face][fila, columna].id
-                    cub.faces[face][fila, columna].color = self.cubo.faces[face][fila, columna].color
-        preset = self.Preset(cub.faces, self.cubo.n, copy.deepcopy(self.cubo.conn), copy.deepcopy(self.cubo.colorRel))
-        return preset
-
-    def loadCuboFrom(self, preset):
-        if self.tamanio.value() != preset.n:
-            self.tamanio.setValue(self.cubo.n)
-        for face in preset.faces:
-            for fila in range(preset.n):
-                for columna in range(preset.n):
-                    self.cubo.faces[face][fila, columna].id = preset.faces[face][fila, columna].id
-                    self.cubo.faces[face][fila, columna].color = preset.faces[face][fila, columna].color
-        self.cubo.n = preset.n
-        self.cubo.conn = copy.deepcopy(preset.conn)
-        self.cubo.colorRel = copy.deepcopy(preset.colorRel)
-        self.renderer.RemoveAllViewProps()
-        self.cubo.inicActores()
-
     @pyqtSlot()
     def clickSavePreset(self):
         p = self.preset.currentText()[0]
-        self.presets[p] = self.saveCubo()
+        self.presets[p] = self.cubo.snapshot()
         self.presetIter += 1
         p = f'{p}: {self.cubo.n}x{self.cubo.n} ({self.presetIter})'
         self.preset.setItemText(self.preset.currentIndex(), p)
@@ -1869,7 +2051,9 @@ class MainWindow(Qt.QMainWindow):
         self.anim.endAllJobs()
         p = self.preset.currentText()[0]
         if p in self.presets:
-            self.loadCuboFrom(self.presets[p])
+            if self.cubo.n != self.presets[p].n:
+                self.tamanio.setValue(self.presets[p].n)  # cambioTamanio reconstruye los actores para el nuevo tamanio
+            self.cubo.restore(self.presets[p])
             self.cubo.resetCamara()
 
     @pyqtSlot()
@@ -1,10 +1,13 @@
 import numpy as np
 import copy
+import time
+from functools import lru_cache
 from pathlib import Path
 import json
+from collections import namedtuple
 
 from util import stripWords, firstAndRest, rangeRC, Vars
-from cubeBasics import Dir, Span, TAddress
+from cubeBasics import Dir, Span, TAddress, Face, ColorRel, colorRelTables, equivalentTable, templateCube, optimizeMoves
 
 # mantengo un 'archivo' de metodos hardcodeado por si se borra el archivo methods.json
 from archivoMetodos import HARD_METHODS
@@ -49,7 +52,10 @@ def matchCelda(vars, coloresPosibles, colorRel, colorCelda):
             c1, c2 = firstAndRest(color[2:], ',')
             c1 = vars.get(c1, default='')
             c2 = vars.get(c2, default='')
-            color = colorRel.listColors(color[0], c1, c2)
+            if debeCoincidir == colorRel.isRelated(color[0], colorCelda, c1, c2):
+                mCelda = True
+                break
+            continue
         if debeCoincidir == (colorCelda in color):  # si (debeCoincidir y coincide) o (no debeCoincidir y no coincide)
             mCelda = True
             break
@@ -78,37 +84,406 @@ def matchCubo(cubo, vars, listaCeldas, posiciones=['-']):
     #        - "a=nombre1[,nombre2]" idem anterior pero en sentido antihorario ("a"nticlockwise)
     #        - "o=nombre" el color de la celda debe coincidir con el correspondiente al opuesto (dentro de este cubo)
     #          al especificado en "nombre"
+    return matchCondiciones(cubo, vars, compilarCeldas(cubo.n, claveCeldas(listaCeldas)), posiciones)
+
+
+class CondCompiladas:
+    # Condiciones de un metodo compiladas para un tamaño de cubo (ver compilarCeldas), listas para matchear
+    #   - indices: array con el indice en el estado del cubo de cada celda, en el orden en que se evaluan
+    #   - grupos: tupla con una entrada por condicion (celda suelta o grupo 'or'), cada una es una tupla con las
+    #             operaciones de sus celdas (ver compilarColores), en el mismo orden que indices
+    #   - inicios: posicion en indices de la 1ra celda de cada grupo
+    #   - vectorizadas: CondVectorizadas si se pueden evaluar todas las posiciones a la vez (ver
+    #                   compilarVectorizadas), si no None
+    #   - cortar: se puede dejar de evaluar una posicion en cuanto falla un grupo (no asigna variables globales)
+    #   - reordenar: ademas se pueden evaluar los grupos en cualquier orden (no asigna ninguna variable)
+    #   - orden: orden en que se evaluan los grupos cuando se corta en el 1er fallo, primero los que mas fallan
+    #   - evaluados, fallos: estadisticas de cada grupo (acumuladas entre resoluciones) para calcular el orden
+    REORDENAR_CADA = 64  # cantidad de fallos entre recalculos del orden
+
+    def __init__(self, indices, grupos, vectorizadas):
+        self.indices = indices
+        self.grupos = grupos
+        self.vectorizadas = vectorizadas
+        self.inicios = []
+        c = 0
+        for grupo in grupos:
+            self.inicios.append(c)
+            c = c + len(grupo)
+        tipos = {op[0] for grupo in grupos for operaciones in grupo for op in operaciones}
+        self.cortar = not (tipos & {'=>', 'celda'})
+        self.reordenar = self.cortar and '->' not in tipos
+        self.orden = list(range(len(grupos)))
+        self.evaluados = [0] * len(grupos)
+        self.fallos = [0] * len(grupos)
+        self.fallosSinOrdenar = 0
+
+    def registrarFallo(self, g):
+        self.fallos[g] = self.fallos[g] + 1
+        self.fallosSinOrdenar = self.fallosSinOrdenar + 1
+        if self.reordenar and self.fallosSinOrdenar >= self.REORDENAR_CADA:
+            self.fallosSinOrdenar = 0
+            # tasa de fallos por celda evaluada (suavizada para los grupos con pocas evaluaciones)
+            self.orden.sort(key=lambda g: -(self.fallos[g] + 1) / ((self.evaluados[g] + 2) * len(self.grupos[g])))
+
+
+def claveCeldas(listaCeldas):
+    # convierte una listaCeldas (ver matchCubo) en una tupla de tuplas, para usarla como clave de los caches
+    return tuple(lc if type(lc) is tuple else tuple(lc) for lc in listaCeldas)
+
+
+@lru_cache(maxsize=None)
+def compilarColores(coloresPosibles):
+    # compila un string de coloresPosibles (ver matchCelda) en una tupla de operaciones que se evaluan en orden
+    # con matchOperaciones, cada operacion es una tupla (tipo, argumentos...):
+    #     ('color', mascara): el codigo del color de la celda esta en la mascara de bits (ver Face.COLORS)
+    #     ('->', nombre) / ('=>', nombre): asigna el color de la celda a la variable local / global
+    #     ('==', nombre) / ('!=', nombre): el color de la celda coincide / no coincide con el de la variable
+    #     ('rel', relacion, debeCoincidir, nombre1, nombre2): relacion entre colores (c=, a=, o=, c!, a!, o!)
+    #     ('celda', color): cualquier otra cosa, se evalua tal cual con matchCelda
+    operaciones = []
+    for color in stripWords(coloresPosibles):
+        if color[0:2] in ('->', '=>', '==', '!='):
+            operaciones.append((color[0:2], color[2:]))
+        elif color[0:2] in 'a= c= o= a! c! o!':
+            if len(color) < 2:
+                operaciones.append(('celda', color))
+            else:
+                c1, c2 = firstAndRest(color[2:], ',')
+                operaciones.append(('rel', color[0], color[1] == '=', c1, c2))
+        else:  # un color fijo, matchea si el nombre del color de la celda esta contenido en el
+            mascara = sum(1 << codigo for codigo, nombre in enumerate(Face.COLORS) if nombre in color)
+            operaciones.append(('color', mascara))
+    return tuple(operaciones)
+
+
+def matchOperaciones(vars, operaciones, colorRel, codigo):
+    # igual que matchCelda pero con los coloresPosibles ya compilados (ver compilarColores)
+    # codigo: el codigo del color de la celda que quiero ver si matchea (ver Face.COLORS)
+    colorCelda = Face.COLORS[codigo]
+    for op in operaciones:
+        tipo = op[0]
+        if tipo == 'color':
+            if (op[1] >> codigo) & 1:
+                return True
+        elif tipo == '->':
+            vars.set(op[1], colorCelda, 'l')
+            return True
+        elif tipo == '=>':
+            vars.set(op[1], colorCelda, 'g')
+            return True
+        elif tipo == '==':
+            if colorCelda in vars.get(op[1], default=''):
+                return True
+        elif tipo == '!=':
+            if colorCelda not in vars.get(op[1], default=''):
+                return True
+        elif tipo == 'rel':
+            mascara = colorRel.mask(op[1], vars.get(op[3], default=''), vars.get(op[4], default=''))
+            if op[2] == ((mascara >> codigo) & 1 == 1):
+                return True
+        elif matchCelda(vars, op[1], colorRel, colorCelda):
+            return True
+    return False
+
+
+@lru_cache(maxsize=4096)
+def compilarCeldas(n, celdas):
+    # compila una listaCeldas (ver matchCubo) para un cubo de tamaño n, devuelve un objeto CondCompiladas
+    # celdas: listaCeldas convertida con claveCeldas
+    cubo = templateCube(n)
+    indices, grupos = [], []
+    for lc in celdas:
+        grupo = (lc,) if len(lc) > 0 and type(lc[0]) is str else lc
+        indices.extend(cubo.index(face, fila, columna) for (face, fila, columna, _) in grupo)
+        grupos.append(tuple(compilarColores(coloresPosibles) for (_, _, _, coloresPosibles) in grupo))
+    return CondCompiladas(np.array(indices, dtype=int), tuple(grupos), compilarVectorizadas(n, celdas))
+
+
+@lru_cache(maxsize=None)
+def condicionesUsanIJK(listaCond):
+    # True si en los rangos de filas o columnas de alguna condicion se usan las variables i, j o k
+    for cond in listaCond:
+        if cond[0:2].upper() == 'OR':
+            if condicionesUsanIJK(tuple(stripWords(cond[2:], ','))):
+                return True
+        elif any(v in rango for rango in stripWords(cond, '.')[1:3] for v in 'ijk'):
+            return True
+    return False
+
+
+@lru_cache(maxsize=4096)
+def compilarCondiciones(n, listaCond, ijk=None, espejo=False):
+    # compila la listaCondiciones de un metodo (ver cond2ListaCeldas) para un cubo de tamaño n
+    # listaCond: tupla con las condiciones
+    # ijk: (i, j, k) con los valores de las variables si las condiciones las usan (ver condicionesUsanIJK), si no None
+    # espejo: compilar las condiciones espejadas (ver mirrorCelda)
+    # devuelve un objeto CondCompiladas
+    cubo = templateCube(n)
+    vars = Vars('l')
+    if ijk is not None:
+        for nombre, valor in zip('ijk', ijk):
+            vars.set(nombre, valor)
+    listaCeldas = cond2ListaCeldas(cubo, vars, list(listaCond))
+    if espejo:
+        listaCeldas = [
+            mirrorCelda(cubo, lc) if type(lc) is tuple else [mirrorCelda(cubo, lcOr) for lcOr in lc]
+            for lc in listaCeldas
+        ]
+    return compilarCeldas(n, claveCeldas(listaCeldas))
+
+
+def condicionesMetodo(cubo, met, espejo=False):
+    # devuelve las condiciones del metodo compiladas para el cubo con los valores actuales de i, j, k
+    listaCond = tuple(met.listaCondiciones)
+    ijk = tuple(cubo.vars.get(v, v) for v in 'ijk') if condicionesUsanIJK(listaCond) else None
+    return compilarCondiciones(cubo.n, listaCond, ijk, espejo)
+
+
+def matchCondiciones(cubo, vars, condiciones, posiciones, bestMatch=True):
+    # igual que matchCubo pero con las condiciones ya compiladas (ver compilarCeldas)
+    # bestMatch: si es falso solo interesa si hay match y en que posicion (la 1ra que matchea), no hace falta
+    #            contar las celdas que matchean en cada posicion y se puede cortar en el 1er fallo (ver matchPrimera)
+    if condiciones.vectorizadas is not None and len(posiciones) > 0:
+        return matchVectorizado(cubo, vars, condiciones, posiciones, bestMatch)
     maxMatches, maxPosicion, matchAlguna = 0, "-", False
-    tAdd = TAddress(cubo, 'F', 0, 0)
-    for posicion in posiciones:
+    if len(posiciones) == 0:
+        return matchAlguna, maxPosicion
+    # los colores de todas las celdas en todas las posiciones, de una sola vez
+    codigos = cubo.colors[tablasPosiciones(cubo.n, tuple(posiciones))[:, condiciones.indices]].tolist()
+    if not bestMatch and condiciones.cortar:
+        return matchPrimera(cubo, vars, condiciones, posiciones, codigos)
+    for posicion, codigosPosicion in zip(posiciones, codigos):
         if posicion == '-':
             posicion = ''
         vars.clear('l')  # reseteo los colores variables locales para esta posicion
-        match, cantMatches = True, 0
-        for lc in listaCeldas:
-            if type(lc) is tuple:
-                (tAdd.f, tAdd.r, tAdd.c, coloresPosibles) = lc
-                tAdd.equivalent(posicion)
-                mCelda = matchCelda(vars, coloresPosibles, cubo.colorRel, cubo.faces[tAdd.f][tAdd.r, tAdd.c].color)
-                if mCelda:
-                    cantMatches = cantMatches + 1
-                match = match and mCelda
-            else:  # es una lista de condiciones a evaluar como 'or'
-                orMatch = False
-                for lcOr in lc:
-                    (tAdd.f, tAdd.r, tAdd.c, coloresPosibles) = lcOr
-                    tAdd.equivalent(posicion)
-                    mCelda = matchCelda(vars, coloresPosibles, cubo.colorRel, cubo.faces[tAdd.f][tAdd.r, tAdd.c].color)
-                    orMatch = orMatch or mCelda
-                if orMatch:
-                    cantMatches = cantMatches + 1
-                match = match and orMatch
+        match, cantMatches, c = True, 0, 0
+        for grupo in condiciones.grupos:
+            orMatch = False  # si el grupo es un 'or' se evaluan todas sus celdas (pueden asignar variables)
+            for operaciones in grupo:
+                orMatch = matchOperaciones(vars, operaciones, cubo.colorRel, codigosPosicion[c]) or orMatch
+                c = c + 1
+            if orMatch:
+                cantMatches = cantMatches + 1
+            match = match and orMatch
         if cantMatches > maxMatches:
             maxMatches, maxPosicion = cantMatches, posicion
         matchAlguna = matchAlguna or match
     return matchAlguna, maxPosicion
 
 
+def matchPrimera(cubo, vars, condiciones, posiciones, codigos):
+    # version de matchCondiciones que deja de evaluar una posicion en cuanto falla un grupo y devuelve la 1ra
+    # posicion donde matchean todos (la misma que devolveria matchCondiciones). Si ninguna matchea devuelve
+    # (False, "-") sin buscar la posicion con mas celdas que matchean.
+    # Solo para condiciones sin variables globales (condiciones.cortar): las locales se resetean en cada posicion
+    # asi que no importa dejar de asignarlas. Si ademas no se asigna ninguna variable (condiciones.reordenar)
+    # los grupos se evaluan en condiciones.orden, primero los que mas fallan.
+    for posicion, codigosPosicion in zip(posiciones, codigos):
+        vars.clear('l')  # reseteo los colores variables locales para esta posicion
+        match = True
+        for g in condiciones.orden:
+            condiciones.evaluados[g] = condiciones.evaluados[g] + 1
+            c = condiciones.inicios[g]
+            orMatch = False
+            for operaciones in condiciones.grupos[g]:
+                orMatch = matchOperaciones(vars, operaciones, cubo.colorRel, codigosPosicion[c]) or orMatch
+                c = c + 1
+            if not orMatch:
+                condiciones.registrarFallo(g)
+                match = False
+                break
+        if match:
+            return True, ('' if posicion == '-' else posicion)
+    return False, "-"
+
+
+class CondVectorizadas(namedtuple('CondVectorizadas',
+                                       'mascaras grupos pruebas celdas refs1 refs2 rels negar unicas iniciosPruebas')):
+    # Condiciones compiladas para evaluarlas en todas las posiciones (y todos los cubos de un lote) a la vez con
+    # arrays (ver compilarVectorizadas y matchVectorizado). Las celdas estan en el orden de CondCompiladas.indices
+    #   - mascaras: array con los bits de los colores fijos aceptados por cada celda (ver Face.COLORS), todos los bits
+    #               si la celda asigna una variable local ('->')
+    #   - grupos: array con el indice de la 1ra celda de cada condicion (celda suelta o grupo 'or')
+    #   - pruebas: cantidad de pruebas contra variables ('==', '!=', relaciones) de todas las celdas, por cada una:
+    #       - celdas: indice de la celda que se prueba
+    #       - refs1, refs2: celdas que asignaron las variables usadas, refs2 = -1 si la relacion no usa 2da variable
+    #                       ('=='/'!=' solo usan refs1)
+    #       - rels: indice de la relacion en ColorRel.RELS, -1 si es una comparacion ('=='/'!=')
+    #       - negar: la prueba se cumple si NO coincide ('!=', 'c!', 'a!', 'o!')
+    #   - unicas, iniciosPruebas: las celdas que tienen pruebas y el indice de su 1ra prueba (ordenadas por celda)
+    __slots__ = ()
+
+
+@lru_cache(maxsize=1024)
+def compilarVectorizadas(n, celdas):
+    # Compila las celdas para matchVectorizado si solo piden colores fijos y comparan con variables locales: '->'
+    # como unica operacion de la celda (siempre asigna), y '==', '!=', 'c=', 'a=', 'o=', 'c!', 'a!', 'o!' sobre
+    # variables asignadas por '->' en celdas anteriores (asi el valor de la variable es el color de esa celda en cada
+    # posicion). Si hay variables globales ('=>'), variables no asignadas antes o colores no reconocidos devuelve None
+    # y se matchea celda por celda con matchOperaciones.
+    # n: tamaño del cubo
+    # celdas: listaCeldas (ver matchCubo) con las sublistas 'or' convertidas en tuplas
+    # devuelve un CondVectorizadas o None
+    todos = (1 << len(Face.COLORS)) - 1
+    mascaras, inicios, pruebas = [], [], []
+    asignadas = {}  # variable: celda que la asigno
+    for lc in celdas:
+        grupo = (lc,) if len(lc) > 0 and type(lc[0]) is str else lc
+        if len(grupo) == 0:
+            return None
+        inicios.append(len(mascaras))
+        for (_, _, _, coloresPosibles) in grupo:
+            celda, mascara = len(mascaras), 0
+            operaciones = compilarColores(coloresPosibles)
+            if len(operaciones) > 0 and operaciones[0][0] == '->':
+                mascaras.append(todos)
+                asignadas[operaciones[0][1]] = celda
+                continue
+            for op in operaciones:
+                if op[0] == 'color':
+                    mascara |= op[1]
+                elif op[0] in ('==', '!=') and op[1] in asignadas:
+                    pruebas.append((celda, asignadas[op[1]], -1, -1, op[0] == '!='))
+                elif op[0] == 'rel' and op[1] in ColorRel.RELS and op[3] in asignadas and \
+                        (op[4] == '' or op[4] in asignadas):
+                    ref2 = asignadas[op[4]] if op[4] != '' else -1
+                    pruebas.append((celda, asignadas[op[3]], ref2, ColorRel.RELS.index(op[1]), not op[2]))
+                else:
+                    return None
+            mascaras.append(mascara)
+    if len(mascaras) == 0:
+        return None
+    pruebas.sort(key=lambda prueba: prueba[0])
+    celdasPruebas, refs1, refs2, rels, negar = (np.array(columna, dtype=int) for columna in zip(*pruebas)) \
+        if pruebas else (np.zeros(0, dtype=int),) * 5
+    unicas, iniciosPruebas = np.unique(celdasPruebas, return_index=True)
+    return CondVectorizadas(np.array(mascaras, dtype=np.uint8), np.array(inicios), len(pruebas), celdasPruebas,
+                            refs1, refs2, rels, negar.astype(bool), unicas, iniciosPruebas)
+
+
+@lru_cache(maxsize=None)
+def tablasRel(scheme):
+    # las tablas de ColorRel de un esquema de colores en un array (relacion x codigo1 x codigo2), ver colorRelTables
+    return np.array([colorRelTables(scheme)[rel] for rel in ColorRel.RELS], dtype=np.uint8)
+
+
+def cantMatchesVectorizado(vectorizadas, colores, colorRel):
+    # cantidad de condiciones (celdas sueltas o grupos 'or') que matchean en cada posicion
+    # colores: array (... x posiciones x celdas) con los codigos de color de las celdas en cada posicion
+    # devuelve un array (... x posiciones)
+    matchCeldas = ((vectorizadas.mascaras >> colores) & 1).astype(bool)
+    if vectorizadas.pruebas > 0:
+        probados = colores[..., vectorizadas.celdas]
+        refs1 = colores[..., vectorizadas.refs1]
+        cumple = probados == refs1
+        rel = vectorizadas.rels >= 0
+        if rel.any():
+            # la 2da variable de la relacion, o len(Face.COLORS) si no la usa (ver colorRelTables)
+            refs2 = np.where(vectorizadas.refs2 >= 0, colores[..., vectorizadas.refs2], len(Face.COLORS))
+            mascarasRel = tablasRel(colorRel.scheme)[np.maximum(vectorizadas.rels, 0), refs1, refs2]
+            cumple = np.where(rel, ((mascarasRel >> probados) & 1).astype(bool), cumple)
+        cumple = cumple != vectorizadas.negar
+        matchCeldas[..., vectorizadas.unicas] |= np.logical_or.reduceat(cumple, vectorizadas.iniciosPruebas, axis=-1)
+    return np.logical_or.reduceat(matchCeldas, vectorizadas.grupos, axis=-1).sum(axis=-1)
+
+
+@lru_cache(maxsize=1024)
+def tablasPosiciones(n, posiciones):
+    # devuelve un array (posiciones x 6n^2) con la tabla de equivalencias de cada posicion (ver equivalentTable)
+    return np.stack([equivalentTable(n, posicion) for posicion in posiciones])
+
+
+def matchVectorizado(cubo, vars, condiciones, posiciones, bestMatch=True):
+    # version vectorizada de matchCondiciones (ver compilarVectorizadas): junta los colores de todas las celdas en
+    # todas las posiciones en una matriz (posiciones x celdas) y evalua las condiciones con operaciones de arrays.
+    # Devuelve lo mismo que matchCondiciones: si alguna posicion matchea y la 1ra posicion con mas celdas que
+    # matchean (o la 1ra que matchea, "-" si ninguna, si no es bestMatch)
+    colores = cubo.colors[tablasPosiciones(cubo.n, tuple(posiciones))[:, condiciones.indices]]
+    cantMatches = cantMatchesVectorizado(condiciones.vectorizadas, colores, cubo.colorRel)
+    vars.clear('l')  # como en matchCubo, las variables locales no se usan fuera del matching
+    mejor = int(np.argmax(cantMatches))
+    matchAlguna = bool(cantMatches[mejor] == len(condiciones.grupos))
+    if cantMatches[mejor] == 0 or not (bestMatch or matchAlguna):
+        return matchAlguna, "-"
+    return matchAlguna, "" if posiciones[mejor] == '-' else posiciones[mejor]
+
+
+def matchLote(lote, vars, condiciones, posiciones, bestMatch=True, cubos=None):
+    # version de matchCondiciones para un lote de cubos (ver cubeBasics.CubeBatch)
+    # las condiciones que se pueden vectorizar (ver compilarVectorizadas) se evaluan en todos los cubos y todas las
+    # posiciones a la vez, con una matriz (cubos x posiciones x celdas), las demas (variables globales, variables no
+    # asignadas en el metodo) cubo por cubo con matchCondiciones sobre un mismo cubo compacto (ver CubeBatch.loadCube)
+    # cubos: indices de los cubos del lote a evaluar, None para todos
+    # devuelve (matches, posiciones): un array con el match de cada cubo y una lista con la posicion encontrada en cada uno
+    cubos = np.arange(len(lote)) if cubos is None else np.asarray(cubos)
+    if len(posiciones) == 0:
+        return np.zeros(len(cubos), dtype=bool), ['-'] * len(cubos)
+    if condiciones.vectorizadas is None:
+        cubo, resultados = None, []
+        for b in cubos.tolist():
+            cubo = lote.loadCube(b, cubo)
+            resultados.append(matchCondiciones(cubo, vars, condiciones, posiciones, bestMatch))
+        return np.array([match for (match, _) in resultados], dtype=bool), [posicion for (_, posicion) in resultados]
+    colores = lote.colors[cubos[:, None, None], tablasPosiciones(lote.n, tuple(posiciones))[:, condiciones.indices]]
+    cantMatches = cantMatchesVectorizado(condiciones.vectorizadas, colores, lote.colorRel)
+    vars.clear('l')  # como en matchCubo, las variables locales no se usan fuera del matching
+    mejor = np.argmax(cantMatches, axis=1)  # la 1ra posicion con mas celdas que matchean, como en matchVectorizado
+    cantMejor = cantMatches[np.arange(len(cubos)), mejor]
+    matches = cantMejor == len(condiciones.grupos)
+    nombres = ['' if posicion == '-' else posicion for posicion in posiciones]
+    return matches, [nombres[m] if c > 0 and (bestMatch or match) else '-'
+                     for m, c, match in zip(mejor.tolist(), cantMejor.tolist(), matches.tolist())]
+
+
+def aplicarMetodoLote(lote, met):
+    # aplica a todos los cubos de un lote (ver cubeBasics.CubeBatch) una vuelta de las condiciones de un metodo, como
+    # lo hace ejecutarMetodoGen pero sin submetodos ni iteraciones: busca las condiciones (y las espejadas en los
+    # cubos donde no se hizo nada, si el metodo lo pide) y mueve juntos a los cubos que encontraron la misma posicion
+    # devuelve (hizo, success): arrays con lo que se hizo en cada cubo (ver ejecutarMetodo)
+    bestMatch = (met.modo.upper() == 'BEST MATCH')
+    hizo = np.zeros(len(lote), dtype=bool)
+    success = np.zeros(len(lote), dtype=bool)
+    condiciones = condicionesMetodo(lote, met)
+    if len(condiciones.grupos) == 0:
+        return hizo, success
+    algoritmo = met.algoritmo
+    algoritmo = algoritmo.replace('i', str(lote.vars.get('i', 'i')))
+    algoritmo = algoritmo.replace('j', str(lote.vars.get('j', 'j')))
+    algoritmo = algoritmo.replace('k', str(lote.vars.get('k', 'k')))
+    for espejo in (False, True):
+        if espejo:
+            if not met.mirror:
+                break
+            condiciones = condicionesMetodo(lote, met, espejo=True)
+        cubos = np.flatnonzero(~hizo)
+        match, posiciones = matchLote(lote, met.vars, condiciones, met.posiciones, bestMatch, cubos)
+        success[cubos] = success[cubos] | match
+        grupos = {}  # posicion: cubos que la encontraron
+        for b, m, posicion in zip(cubos.tolist(), match.tolist(), posiciones):
+            if m or bestMatch:
+                grupos.setdefault(posicion, []).append(b)
+        for posicion, cubosPosicion in grupos.items():
+            lote.makeMoves(posicion + (' >< ' if espejo else ' ') + algoritmo, which=cubosPosicion)
+            hizo[cubosPosicion] = (posicion != '' or algoritmo != '')
+    return hizo, success
+
+
+class ValoresIJK(namedtuple('ValoresIJK', 'i j k')):
+    # Valores de las variables i, j, k en un momento de la ejecucion. Es inmutable, asi que los renglones de la
+    # solucion con los mismos valores comparten el mismo objeto (ver valoresIJK). Se consulta igual que un Vars.
+    __slots__ = ()
+
+    def get(self, var, default=None):
+        valor = getattr(self, var, None) if var in self._fields else None
+        return default if valor is None else valor
+
+
+@lru_cache(maxsize=None)
+def valoresIJK(i, j, k):
+    return ValoresIJK(i, j, k)
+
+
 class Sol:
     # Registro conteniendo la info necesaria para mostrar/ejecutar la resolucion del cubo
     #   - level: Profundidad del arbol de metodos recorrida hasta aqui (para poder mostrar indentados los metodos)
@@ -120,7 +495,9 @@ class Sol:
     #   - hizo: Verdadero si este metodo se aplico, falso si solo se invoco pero no se utilizo
     #   - metodo: Metodo aplicado (objeto)
     #   - mirror: Si se aplico el metodo espejado o no
-    #   - vars: Copia de los valores que tenían las variables en este momento de la ejecución (sobre todo me interesan i,j,k)
+    #   - vars: Valores que tenían las variables i, j, k en este momento de la ejecución (objeto ValoresIJK)
+    __slots__ = ('level', 'tipo', 'texto', 'hizo', 'metodo', 'mirror', 'vars')
+
     def __init__(self, level, tipo, texto, hizo, metodo, mirror, vars):
         self.level = level
         self.tipo = tipo
@@ -128,10 +505,84 @@ class Sol:
         self.hizo = hizo
         self.metodo = metodo
         self.mirror = mirror
-        self.vars = copy.deepcopy(vars)
+        self.vars = vars if isinstance(vars, ValoresIJK) else valoresIJK(vars.get('i'), vars.get('j'), vars.get('k'))
+
+
+# Evento que entrega ejecutarMetodoGen al terminar un metodo: el renglon 'Met' del metodo y lo que devolvio
+FinMetodo = namedtuple('FinMetodo', 'sol hizo success')
+
+
+class Perfil:
+    # Estadisticas de la ejecucion de los metodos, para encontrar los que consumen mas tiempo. Se le pasa a
+    # ejecutarMetodo (opcional) y va acumulando por id de metodo (ver Perfil.Datos), entre varias ejecuciones.
+    # Se exporta como JSON (aDict) o como pilas colapsadas para generar un flame graph (pilasColapsadas).
+    class Datos:
+        def __init__(self):
+            self.llamadas = 0  # veces que se ejecuto el metodo
+            self.iteraciones = 0  # vueltas del loop de ejecutarMetodo (Repeat, Times, rangos de i, j, k)
+            self.intentos = 0  # veces que se buscaron las condiciones (cada una en todas las posiciones del metodo)
+            self.aciertos = 0  # veces que las condiciones matchearon
+            self.aciertosPorPosicion = {}  # posicion en que se encontro el match: cantidad
+            self.movimientos = 0  # movimientos agregados a la solucion (posicionamiento + algoritmo)
+            self.tiempo = 0.0  # tiempo acumulado, incluyendo submetodos
+            self.tiempoPropio = 0.0  # tiempo acumulado sin contar los submetodos
+
+    def __init__(self):
+        self.datos = {}  # id de metodo: Datos
+        self.pilas = {}  # tupla de ids de metodos (del top level al actual): tiempo propio acumulado
+        self.pila = []  # [id, inicio, tiempo de los submetodos] de los metodos en ejecucion
+
+    def metodo(self, id):
+        if id not in self.datos:
+            self.datos[id] = self.Datos()
+        return self.datos[id]
 
+    def entrar(self, id):
+        self.metodo(id).llamadas += 1
+        self.pila.append([id, time.perf_counter(), 0.0])
 
-def cantMovim(soluc):
+    def salir(self):
+        id, inicio, tiempoSubMetodos = self.pila.pop()
+        tiempo = time.perf_counter() - inicio
+        datos = self.metodo(id)
+        datos.tiempo += tiempo
+        datos.tiempoPropio += tiempo - tiempoSubMetodos
+        if self.pila:
+            self.pila[-1][2] += tiempo
+        pila = tuple(m[0] for m in self.pila) + (id,)
+        self.pilas[pila] = self.pilas.get(pila, 0.0) + tiempo - tiempoSubMetodos
+
+    def iteracion(self, id):
+        self.metodo(id).iteraciones += 1
+
+    def match(self, id, match, posicion):
+        datos = self.metodo(id)
+        datos.intentos += 1
+        if match:
+            datos.aciertos += 1
+            datos.aciertosPorPosicion[posicion] = datos.aciertosPorPosicion.get(posicion, 0) + 1
+
+    def movimientos(self, id, movimientos):
+        self.metodo(id).movimientos += len(stripWords(movimientos))
+
+    def aDict(self):
+        # devuelve un dict (para grabar como JSON) con los datos de cada metodo, los que mas tiempo consumen primero
+        metodos = sorted(self.datos.items(), key=lambda item: -item[1].tiempoPropio)
+        return {id: dict(vars(datos)) for id, datos in metodos}
+
+    def pilasColapsadas(self):
+        # devuelve un string con una linea por pila de metodos: 'metodo;submetodo;subsubmetodo microsegundos'
+        # (el formato 'collapsed' de flamegraph.pl, speedscope, etc.) con el tiempo propio del ultimo de la pila
+        return ''.join(
+            '{0} {1}\n'.format(';'.join(id.replace(';', ',') for id in pila), round(t * 1e6))
+            for pila, t in self.pilas.items()
+        )
+
+
+def cantMovim(soluc, n=0):
+    # cantidad de movimientos de la solucion, si se indica el tamaño del cubo (n) los de la solucion optimizada
+    if n > 0:
+        return len(stripWords(optimizarSolucion(n, soluc)))
     c = 0
     for s in soluc:
         if s.tipo in 'Alg/Pos':
@@ -139,10 +590,116 @@ def cantMovim(soluc):
     return c
 
 
-def ejecutarMetodo(cubo, met, solucion, level=0):
+def optimizarSolucion(n, soluc):
+    # devuelve un string con todos los movimientos de la solucion optimizados (ver cubeBasics.optimizeMoves):
+    # cancela y junta los movimientos redundantes y lleva las rotaciones del cubo al final
+    return optimizeMoves(n, ' '.join(s.texto for s in soluc if s.tipo in ('Pos', 'Alg')))
+
+
+class MemoMetodos:
+    # Cache de los metodos que no hicieron nada, valida durante una resolucion: si se vuelve a ejecutar un metodo con
+    # el cubo en el mismo estado, los mismos valores de i, j, k y las mismas variables globales, el resultado va a ser
+    # el mismo, asi que se repiten los eventos que genero (renglones 'Met' sin hacer nada y sus FinMetodo) sin volver
+    # a evaluarlo.
+    #   - eventos: los eventos que entrego ejecutarMetodoGen desde el ultimo renglon que hizo algo ('Pos', 'Alg'), de
+    #              ahi se sacan los de cada metodo. Los metodos que estaban en ejecucion cuando se descartaron hicieron
+    #              algo, asi que no se guardan y la lista no crece mas que los metodos ejecutados entre movimiento y
+    #              movimiento
+    #   - descartados: cantidad de eventos descartados, para ubicar los de cada metodo (ver inicio)
+    #   - resultados: clave (ver clave) -> (success, i, j, k, variables globales, variables locales, eventos)
+    #   - aciertos: cantidad de ejecuciones que se evitaron
+    def __init__(self):
+        self.eventos = []
+        self.descartados = 0
+        self.resultados = {}
+        self.aciertos = 0
+
+    def anotar(self, evento):
+        # agrega un evento entregado por ejecutarMetodoGen y lo devuelve
+        if type(evento) is Sol and evento.tipo != 'Met':
+            self.descartados += len(self.eventos) + 1
+            self.eventos.clear()
+        else:
+            self.eventos.append(evento)
+        return evento
+
+    def inicio(self):
+        # posicion (contando los descartados) del proximo evento
+        return self.descartados + len(self.eventos)
+
+    def guardar(self, clave, cubo, met, level, inicio, success):
+        # guarda el resultado de un metodo que no hizo nada, con los eventos que genero desde inicio (ver inicio):
+        # ('Met', nivel relativo a level, texto, metodo, vars) por cada renglon y ('Fin', indice del renglon
+        # del metodo, success) por cada FinMetodo
+        if inicio < self.descartados:  # se descartaron eventos del metodo, algo hizo
+            return
+        eventos, renglones = self.eventos[inicio - self.descartados:], {}
+        guardados = []
+        for evento in eventos:
+            if type(evento) is Sol:
+                renglones[id(evento)] = len(guardados)
+                guardados.append(('Met', evento.level - level, evento.texto, evento.metodo, evento.vars))
+            elif id(evento.sol) in renglones:
+                guardados.append(('Fin', renglones[id(evento.sol)], evento.success))
+            else:
+                return
+        self.resultados[clave] = (
+            success, tuple(cubo.vars.get(v) for v in 'ijk'), dict(met.vars.vars('g')), dict(met.vars.vars('l')),
+            tuple(guardados)
+        )
+
+    def repetir(self, resultado, level, filas):
+        # generador que vuelve a entregar los eventos de un resultado guardado, con renglones nuevos
+        renglones = []
+        for guardado in resultado:
+            if guardado[0] == 'Met':
+                _, nivel, texto, metodo, vars = guardado
+                renglones.append(Sol(level + nivel, 'Met', texto, False, metodo, False, vars))
+                filas[0] += 1
+                yield self.anotar(renglones[-1])
+            else:
+                _, renglon, success = guardado
+                renglones.append(None)
+                yield self.anotar(FinMetodo(renglones[renglon], False, success))
+
+    @staticmethod
+    def clave(cubo, met):
+        ijk = tuple(cubo.vars.get(v) for v in 'ijk')
+        globales = tuple(sorted(met.vars.vars('g').items(), key=lambda item: item[0]))
+        return (met.id, ijk, cubo.stateKey(), globales)
+
+
+def ejecutarMetodo(cubo, met, solucion, level=0, perfil=None, memo=True):
+    # Ejecuta el metodo agregando a la lista solucion los renglones (objetos Sol) que va generando ejecutarMetodoGen
+    # devuelve (hizo, success), ver ejecutarMetodoGen
+    # memo: usar una cache (MemoMetodos) para no repetir los metodos que no hicieron nada con el cubo en el mismo estado.
+    #       Si se pasa un perfil no se usa, para que las estadisticas cuenten todas las llamadas, iteraciones e intentos
+    gen = ejecutarMetodoGen(cubo, met, level, perfil, [len(solucion)], MemoMetodos() if memo else None)
+    while True:
+        try:
+            evento = next(gen)
+        except StopIteration as fin:
+            return fin.value
+        if type(evento) is Sol:
+            solucion.append(evento)
+
+
+def ejecutarMetodoGen(cubo, met, level=0, perfil=None, filas=None, memo=None):
+    # Generador que ejecuta el metodo y va entregando la solucion a medida que se produce, sin acumularla:
+    #     - un objeto Sol por cada renglon de la solucion ('Met' al empezar cada metodo, 'Pos' y 'Alg')
+    #     - un objeto FinMetodo al terminar cada metodo (con el hizo ya actualizado en el renglon 'Met' del metodo)
+    # al terminar devuelve (hizo, success) como valor de retorno del generador (StopIteration.value / yield from)
+    #     hizo: si el metodo (o alguno de sus submetodos) hizo algun movimiento
+    #     success: si las condiciones del metodo (o de sus submetodos, segun until1st) matchearon
+    # filas: [cantidad de renglones generados hasta ahora], compartida con los submetodos para cortar si se pasa de 20000
+    # memo: (opcional) objeto MemoMetodos, los metodos que se salteen por estar en la cache entregan los mismos eventos
+    #       que si se ejecutaran. No se usa si se pasa un perfil (los metodos salteados no se contarian en las
+    #       estadisticas)
     # level: Para poder mostrar indentados los metodos y sub metodos que se van utilizando.
+    # perfil: (opcional) objeto de tipo Perfil donde acumular las estadisticas de la ejecucion de cada metodo
     # cubo: Cube que se va a resolver (se modifica durante la ejecucion del metodo)
     # solucion: Lista de los metodos utilizados en la ejecucion. Cada elemento de la lista es un objeto de tipo Sol
+    #     (en ejecutarMetodoGen no se recibe, se van entregando los renglones)
     # met: objeto de la clase Metodo, con los siguientes campos:
     #     id: string descriptivo del metodo (para mostrar cuando arrancan los algoritmos correspondientes a este metodo)
     #     minLado: tamaño minimo que tiene que tener el cubo para ejecutar este metodo
@@ -153,9 +710,30 @@ def ejecutarMetodo(cubo, met, solucion, level=0):
     #     mirror: buscar o no la posicion en espejo para las condiciones
     #     posiciones: lista de posiciones del cubo en que se buscan las condiciones
     #     algoritmo: string
+    if filas is None:
+        filas = [0]
+    if perfil is not None:
+        memo = None
+    anotar = memo.anotar if memo is not None else (lambda evento: evento)
     if cubo.n < met.minLado:
-        solucion.append(Sol(level, 'Met', met.id, False, met, False, cubo.vars))
+        sol = Sol(level, 'Met', met.id, False, met, False, cubo.vars)
+        filas[0] += 1
+        yield anotar(sol)
+        yield anotar(FinMetodo(sol, False, True))
         return False, True
+    if memo is not None:
+        clave = MemoMetodos.clave(cubo, met)
+        if clave in memo.resultados:
+            memo.aciertos += 1
+            success, ijk, globales, locales, eventos = memo.resultados[clave]
+            yield from memo.repetir(eventos, level, filas)
+            for v, valor in zip('ijk', ijk):
+                cubo.vars.set(v, valor)
+            met.vars.dicts['g'], met.vars.dicts['l'] = dict(globales), dict(locales)
+            return False, success
+        inicio = memo.inicio()
+    if perfil is not None:
+        perfil.entrar(met.id)
     # la opcion 'repeat' es en realidad 6(n^2) veces, para no entrar en un loop infinito si hay un error en el metodo
     cantVeces = 6 * (cubo.n ** 2) if met.modo.upper() == 'REPEAT' else 0
     cantVeces = 1 if met.modo.upper() in 'ONCE / BEST MATCH' else cantVeces
@@ -175,29 +753,35 @@ def ejecutarMetodo(cubo, met, solucion, level=0):
         sp = Span(cubo, met.rangoK, checkLimits=False)
         begK, endK = sp.beg + 1, sp.end + 1
         cubo.vars.set('k', begK)
-    iSol = len(solucion)
-    solucion.append(Sol(level, 'Met', met.id, False, met, False, cubo.vars))
+    solMet = Sol(level, 'Met', met.id, False, met, False, cubo.vars)
+    filas[0] += 1
+    yield anotar(solMet)
     hizoAlgo, success = False, False
     seguir, cant = True, 0
     while seguir and (cant < cantVeces):
-        if len(solucion) > 20000:  # solo para debug de algunos metodos
+        if filas[0] > 20000:  # solo para debug de algunos metodos
             print('OVERFLOW !!!!')
-            print(f'metodo: {met.id} len(soluc): {len(solucion)}, cant: {cant}, cantVeces: {cantVeces}')
-            solucion.append(Sol(level + 1, 'Pos', 'X2 X2 X2 X2', True, met, False, cubo.vars))
+            print(f'metodo: {met.id} len(soluc): {filas[0]}, cant: {cant}, cantVeces: {cantVeces}')
+            filas[0] += 1
+            yield anotar(Sol(level + 1, 'Pos', 'X2 X2 X2 X2', True, met, False, cubo.vars))
             break
         seguir = False
+        if perfil is not None:
+            perfil.iteracion(met.id)
         for idSubMetodo in met.subMetodos:
-            (hizo, success) = ejecutarMetodo(cubo, met.metodo(idSubMetodo), solucion, level + 1)
+            (hizo, success) = yield from ejecutarMetodoGen(cubo, met.metodo(idSubMetodo), level + 1, perfil, filas, memo)
             hizoAlgo = hizoAlgo or hizo
             seguir = seguir or hizo
             if success and met.until1st.upper() == 'SUCCESS':
                 break
             if not success and met.until1st.upper() == 'FAILURE':
                 break
-        listaCeldas = cond2ListaCeldas(cubo, cubo.vars, met.listaCondiciones)
+        condiciones = condicionesMetodo(cubo, met)
         hizo = False
-        if len(listaCeldas) > 0:
-            match, posicion = matchCubo(cubo, met.vars, listaCeldas, met.posiciones)
+        if len(condiciones.grupos) > 0:
+            match, posicion = matchCondiciones(cubo, met.vars, condiciones, met.posiciones, bestMatch)
+            if perfil is not None:
+                perfil.match(met.id, match, posicion)
             success = success or match
             if match or bestMatch:
                 algoritmo = met.algoritmo
@@ -206,22 +790,23 @@ def ejecutarMetodo(cubo, met, solucion, level=0):
                 algoritmo = algoritmo.replace('k', str(cubo.vars.get('k', 'k')))
                 cubo.makeMoves(posicion + ' ' + algoritmo)
                 hizo = (posicion != '' or algoritmo != '')
+                if hizo and perfil is not None:
+                    perfil.movimientos(met.id, posicion + ' ' + algoritmo)
                 if hizo:
                     if posicion != '':
-                        solucion.append(Sol(level + 1, 'Pos', posicion, hizo, met, False, cubo.vars))
+                        filas[0] += 1
+                        yield anotar(Sol(level + 1, 'Pos', posicion, hizo, met, False, cubo.vars))
                     if algoritmo != '':
-                        solucion.append(Sol(level + 1, 'Alg', algoritmo, hizo, met, False, cubo.vars))
+                        filas[0] += 1
+                        yield anotar(Sol(level + 1, 'Alg', algoritmo, hizo, met, False, cubo.vars))
                 hizoAlgo = hizoAlgo or hizo
                 seguir = seguir or hizo
         # si no se hizo movimientos y lo especifica el metodo, pruebo con las condiciones espejadas
-        if not hizo and met.mirror and len(listaCeldas) > 0:
-            for c in range(len(listaCeldas)):
-                if type(listaCeldas[c]) is tuple:
-                    listaCeldas[c] = mirrorCelda(cubo, listaCeldas[c])
-                elif type(listaCeldas[c]) is list:
-                    for cc in range(len(listaCeldas[c])):
-                        listaCeldas[c][cc] = mirrorCelda(cubo, listaCeldas[c][cc])
-            match, posicion = matchCubo(cubo, met.vars, listaCeldas, met.posiciones)
+        if not hizo and met.mirror and len(condiciones.grupos) > 0:
+            condiciones = condicionesMetodo(cubo, met, espejo=True)
+            match, posicion = matchCondiciones(cubo, met.vars, condiciones, met.posiciones, bestMatch)
+            if perfil is not None:
+                perfil.match(met.id, match, '>< ' + posicion)  # las posiciones espejadas se cuentan aparte
             success = success or match
             if match or bestMatch:
                 algoritmo = met.algoritmo
@@ -231,12 +816,15 @@ def ejecutarMetodo(cubo, met, solucion, level=0):
                 cubo.makeMoves(
                     posicion + ' >< ' + algoritmo)  # los movimientos que siguen a un '><' se ejecutan en espejo
                 hizo = (posicion != '' or algoritmo != '')
+                if hizo and perfil is not None:
+                    perfil.movimientos(met.id, posicion + ' ' + algoritmo)
                 if hizo:
                     if posicion != '':
-                        solucion.append(Sol(level + 1, 'Pos', posicion, hizo, met, True, cubo.vars))
+                        filas[0] += 1
+                        yield anotar(Sol(level + 1, 'Pos', posicion, hizo, met, True, cubo.vars))
                     if algoritmo != '':
-                        solucion.append(
-                            Sol(level + 1, 'Alg', '>< {0} ><'.format(algoritmo), hizo, met, True, cubo.vars))
+                        filas[0] += 1
+                        yield anotar(Sol(level + 1, 'Alg', '>< {0} ><'.format(algoritmo), hizo, met, True, cubo.vars))
                 hizoAlgo = hizoAlgo or hizo
                 seguir = seguir or hizo
         cant = cant + 1
@@ -266,7 +854,13 @@ def ejecutarMetodo(cubo, met, solucion, level=0):
                     proxIter = False
             if not proxIter:
                 seguir, cant = True, 0
-    solucion[iSol].hizo = hizoAlgo
+    solMet.hizo = hizoAlgo
+    if perfil is not None:
+        perfil.salir()
+    fin = anotar(FinMetodo(solMet, hizoAlgo, success))
+    if memo is not None and not hizoAlgo:  # no hizo nada: guardo el resultado y los eventos que genero
+        memo.guardar(clave, cubo, met, level, inicio, success)
+    yield fin
     return hizoAlgo, success
 
 
@@ -549,9 +1143,7 @@ class Metodos:
         self.modif = False
 
     def loadFromFile(self):
-        p = Path('.')
-        files = [file.name for file in p.glob('*.json')]
-        if self.archivo in files:
+        if Path(self.archivo).is_file():
             with open(self.archivo) as json_file:
                 self.metDict = json.load(json_file)
             self.modif = False
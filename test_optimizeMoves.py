@@ -0,0 +1,35 @@
+# pruebas de cubeBasics.optimizeMoves: con strings de movimientos al azar, el resultado tiene que dejar el cubo
+# exactamente igual (la misma permutacion) y nunca tener mas movimientos que el original
+
+import numpy as np
+import pytest
+
+from cubeBasics import Cube, compileMoves, optimizeMoves
+
+# movimientos en notacion estandar, incluyendo rotaciones del cubo y de capas intermedias, y algunos en la
+# notacion <cara>.<capas>.<veces><direccion>
+MOVIMIENTOS = [f + s for f in 'UDLRFBudlrfbxyzMES' for s in ('', "'", '2')] + \
+              ['U.c.2l', 'R.2:3.u', 'F.2.d', 'L.1:2.r', 'D.-1.l', 'B.2:-2.2u']
+
+
+def movimientosAlAzar(n, rng):
+    # un string de 1 a 12 movimientos, la mitad de las veces como los genera Cube.shuffle
+    if rng.randint(2):
+        return Cube(n, compact=True, ids=False).shuffle(rng.randint(1, 13), rng=rng)
+    return ' '.join(rng.choice(MOVIMIENTOS, rng.randint(1, 13)))
+
+
+@pytest.mark.parametrize('n', [2, 3, 4, 5, 6, 7])
+def test_optimizeMoves(n):
+    rng = np.random.RandomState(n)
+    for _ in range(200):
+        sMoves = movimientosAlAzar(n, rng)
+        optimizados = optimizeMoves(n, sMoves)
+        assert np.array_equal(compileMoves(n, sMoves), compileMoves(n, optimizados)), (sMoves, optimizados)
+        assert len(optimizados.split()) <= len(sMoves.split()), (sMoves, optimizados)
+
+
+def test_optimizeMovesCancela():
+    assert optimizeMoves(3, "R U U' R'") == ''
+    assert optimizeMoves(3, 'U U') == 'U2'
+    assert optimizeMoves(5, 'b U.c.2l') == 'b R.3.2d'
@@ -1,7 +1,8 @@
 # funciones varias que no tienen que ver con un proyecto en particular
 
-from PyQt5 import QtCore, QtGui
-from PyQt5 import Qt
+import ast
+import operator
+from functools import lru_cache
 
 
 class Vars:
@@ -102,6 +103,57 @@ def stripWords(string, sep=' '):
     return [w.strip() for w in string.split(sep) if w.strip()]
 
 
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+@lru_cache(maxsize=None)
+def parseExpr(expr):
+    """
+    Parses and validates a simple arithmetic expression (see evalExpr)
+    :param expr: string with the expression
+    :return: the root node of the syntax tree of the expression
+    """
+    tree = ast.parse(expr.strip(), mode='eval').body
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float):
+                raise ValueError(f'Invalid constant in expression: {expr}')
+        elif not isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Name, ast.Load)) and type(node) not in _OPERATORS:
+            raise ValueError(f'Invalid expression: {expr}')
+    return tree
+
+
+def evalExpr(expr, names):
+    """
+    Evaluates a simple arithmetic expression without using eval(). The expression can only contain numbers, names,
+    the operators + - * / // % and parenthesis
+    :param expr: string with the expression, ie 'B-1' or '(c+C)//2'
+    :param names: dict with the values of the names used in the expression
+    :return: the value of the expression
+    """
+    def evalNode(node):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id not in names:
+                raise NameError(f"name '{node.id}' is not defined")
+            return names[node.id]
+        if isinstance(node, ast.UnaryOp):
+            return _OPERATORS[type(node.op)](evalNode(node.operand))
+        return _OPERATORS[type(node.op)](evalNode(node.left), evalNode(node.right))
+
+    return evalNode(parseExpr(expr))
+
+
 def rangeRC(rowInterval, columnInterval, step=(0, 0)):
     """
     Returns an iterable of tuples (row, column) with all the values in the rows interval and columns interval using